@@ -0,0 +1,174 @@
+import cv2
+import numpy as np
+from template import get_template
+
+# The frame a sheet is aligned to (its size and where the answer table's
+# corners go) is the form's page_size and table_corners (template.py).
+
+# Width the image is shrunk to before looking for the table.
+DETECT_WIDTH = 400
+
+# The table must cover at least this fraction of the image to be trusted.
+MIN_TABLE_AREA = 0.3
+
+# A side of the table is fitted to the outline points within this fraction
+# of the image width of its outer edge (see fit_corners).
+SIDE_TOLERANCE = 0.02
+
+# Rounds of fitting the sides and intersecting them.
+FIT_ROUNDS = 2
+
+# Sheets whose table corners are all within this many pixels of the
+# canonical ones are only resized, not warped.
+ALIGN_TOLERANCE = 3
+
+
+def find_table_corners(img):
+    """
+    Find the four corners of the answer table (the largest outlined shape on
+    the sheet) on a downsampled copy of img. The extreme points of its
+    outline are refined by fit_corners, so corners that fall just outside
+    a skewed sheet are still placed right.
+
+    Returns:
+      a (4, 2) float32 array of the corners in img coordinates, ordered
+      top-left, top-right, bottom-right, bottom-left; or None when no
+      plausible table was found.
+    """
+    scale = DETECT_WIDTH / img.shape[1]
+    small = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    # Adaptive threshold keeps faint, unevenly lit rules that Otsu loses.
+    binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
+                                   cv2.THRESH_BINARY_INV, 15, 8)
+    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+    if not contours:
+        return None
+    points = max(contours, key=cv2.contourArea).reshape(-1, 2).astype(np.float32)
+
+    # The corners are the extreme points along both diagonals.
+    sums = points.sum(axis=1)
+    diffs = points[:, 0] - points[:, 1]
+    corners = np.float32([
+        points[sums.argmin()],   # top-left
+        points[diffs.argmax()],  # top-right
+        points[sums.argmax()],   # bottom-right
+        points[diffs.argmin()],  # bottom-left
+    ])
+
+    corners = fit_corners(points, corners, small.shape)
+
+    area = cv2.contourArea(corners) / (small.shape[0] * small.shape[1])
+    if area < MIN_TABLE_AREA or not cv2.isContourConvex(corners.reshape(-1, 1, 2)):
+        return None
+    return corners / scale
+
+
+def fit_corners(points, corners, shape, rounds=FIT_ROUNDS):
+    """
+    Refine the corners of the table outline: fit a line to the outline
+    points along every side and intersect neighbouring sides. On a skewed
+    sheet a corner of the table can lie outside the image, where the
+    outline runs along the image border or cuts through the table instead;
+    border points are left out, every side is fitted to the outermost
+    points in the skew direction of the whole table (the median over its
+    four sides, so one bad corner does not tilt the others) and the lost
+    corner is extrapolated from its two sides.
+
+    Input:
+      points: (N, 2) float32 outline points (every pixel of the contour).
+      corners: (4, 2) float32 first guess (top-left, top-right,
+               bottom-right, bottom-left).
+      shape: shape of the image the points are in.
+
+    Returns:
+      the refined (4, 2) float32 corners, or the first guess when a side
+      has too few points to fit.
+    """
+    height, width = shape[:2]
+    inside = ((points[:, 0] > 1) & (points[:, 0] < width - 2)
+              & (points[:, 1] > 1) & (points[:, 1] < height - 2))
+    points = points[inside]
+    max_distance = SIDE_TOLERANCE * width
+
+    for _ in range(rounds):
+        # Skew of the table: how far each side is turned from upright
+        # (top runs right, right runs down, ...), median of the four.
+        turns = []
+        for i in range(4):
+            dx, dy = corners[(i + 1) % 4] - corners[i]
+            turn = np.arctan2(dy, dx) - i * np.pi / 2
+            turns.append((turn + np.pi) % (2 * np.pi) - np.pi)
+        skew = float(np.median(turns))
+
+        lines = []
+        for i in range(4):
+            angle = skew + i * np.pi / 2
+            direction = np.float32([np.cos(angle), np.sin(angle)])
+            outward = np.float32([direction[1], -direction[0]])
+            # Points away from the (uncertain) ends of the side...
+            along = points @ direction
+            start, end = corners[i] @ direction, corners[(i + 1) % 4] @ direction
+            margin = 0.05 * (end - start)
+            candidates = points[(along > start + margin) & (along < end - margin)]
+            if len(candidates) < 2:
+                return corners
+            # ...and at the outer edge of the outline there.
+            offsets = candidates @ outward
+            edge = np.percentile(offsets, 99)
+            near = candidates[offsets > edge - max_distance]
+            if len(near) < 2:
+                return corners
+            vx, vy, x0, y0 = cv2.fitLine(near, cv2.DIST_HUBER, 0, 0.01, 0.01).ravel()
+            lines.append((np.float32([x0, y0]), np.float32([vx, vy])))
+
+        # Corner i is where side i - 1 (ending there) meets side i.
+        fitted = []
+        for i in range(4):
+            (p1, d1), (p2, d2) = lines[i - 1], lines[i]
+            matrix = np.float32([d1, -d2]).T
+            if abs(np.linalg.det(matrix)) < 1e-6:
+                return corners
+            t, _ = np.linalg.solve(matrix, p2 - p1)
+            fitted.append(p1 + t * d1)
+        corners = np.float32(fitted)
+    return corners
+
+
+def align_page(img, template=None, corners=None):
+    """
+    Bring a sheet into the frame of its form (template.py; default form when
+    None): find the answer table and map its corners onto the form's
+    table_corners with a single warpPerspective. Sheets that are already
+    aligned (or where no table is found) are just resized. corners are the
+    table corners when they are already known (e.g. from
+    identify.identify_form); None looks for them.
+
+    Returns:
+      aligned: the image, of the form's page_size.
+      warped: True if a perspective warp was applied.
+    """
+    form = template or get_template()
+    size, target = form.page_size, form.table_corners
+    height, width = img.shape[:2]
+    if corners is None:
+        corners = find_table_corners(img)
+    if corners is None:
+        return _resize(img, size), False
+
+    # Corner positions if the image were simply resized to the page size.
+    scaled = corners * np.float32([size[0] / width, size[1] / height])
+    if np.abs(scaled - target).max() <= ALIGN_TOLERANCE:
+        return _resize(img, size), False
+
+    matrix = cv2.getPerspectiveTransform(corners, target)
+    aligned = cv2.warpPerspective(img, matrix, size, flags=cv2.INTER_LINEAR,
+                                  borderMode=cv2.BORDER_REPLICATE)
+    return aligned, True
+
+
+def _resize(img, size):
+    if img.shape[1] == size[0] and img.shape[0] == size[1]:
+        return img
+    return cv2.resize(img, size)
@@ -0,0 +1,343 @@
+import sys
+import csv
+import html
+import argparse
+import warnings
+
+import numpy as np
+from store import DEFAULT_DB_PATH, ResultStore
+from template import get_template
+
+# Percentiles of the section totals reported per faculty member.
+PERCENTILES = (25, 50, 75)
+
+# Label of sheets stored without a faculty member.
+UNASSIGNED = "(unassigned)"
+
+
+class ScoreTable:
+    """
+    The stored scores of one form as one dense array (sections and rows
+    only line up between sheets of the same form).
+
+    Attributes:
+      form: id of the form (template.py) the sheets were scored as.
+      scale: the form's rating scale; answers are scored 1..scale (see
+             form_scale).
+      scores: float array (sheets x sections x rows); NaN where a question
+              was not answered (or the section has fewer rows).
+      faculty: array with the faculty member of every sheet.
+      sections: section names, in the order of the second axis.
+      sheet_ids: database id of every sheet, in the order of the first axis.
+    """
+
+    def __init__(self, scores, faculty, sections, sheet_ids, form=None, scale=None):
+        self.form = form
+        self.scale = scale if scale is not None else form_scale(form, scores)
+        self.scores = scores
+        self.faculty = faculty
+        self.sections = sections
+        self.sheet_ids = sheet_ids
+
+
+def load_table(store, faculty=None, term=None, form=None):
+    """
+    Build the ScoreTable of the sheets of one form in a ResultStore
+    (optionally one faculty/term).
+    """
+    sheets = store.sheets(faculty, term, form)
+    by_section = {section: np.asarray(rows, dtype=np.int64).reshape(-1, 3)
+                  for section, rows in store.section_row_scores(faculty, term, form).items()}
+    sections = [section for section, rows in by_section.items() if len(rows)]
+    if not sheets or not sections:
+        return ScoreTable(np.full((0, 0, 0), np.nan), np.array([], dtype=object), [],
+                          np.array([], dtype=np.int64), form)
+
+    sheet_ids = np.asarray([sheet_id for sheet_id, _ in sheets], dtype=np.int64)
+    faculty_names = np.asarray([name for _, name in sheets], dtype=object)
+    faculty_names[np.equal(faculty_names, None)] = UNASSIGNED
+
+    n_rows = max(int(by_section[section][:, 1].max()) for section in sections)
+    scores = np.full((len(sheet_ids), len(sections), n_rows), np.nan)
+    for s, section in enumerate(sections):
+        rows = by_section[section]
+        # sheet_ids is sorted, so a binary search maps ids to positions.
+        scores[np.searchsorted(sheet_ids, rows[:, 0]), s, rows[:, 1] - 1] = rows[:, 2]
+    return ScoreTable(scores, faculty_names, sections, sheet_ids, form)
+
+
+def form_scale(form_id, scores):
+    """
+    Rating scale of a form: the number of answer columns of its template.
+    A form that is no longer in forms/ falls back to the highest stored
+    score in scores.
+    """
+    try:
+        return get_template(form_id).columns
+    except KeyError:
+        answered = scores[~np.isnan(scores)]
+        return max(int(answered.max()), 1) if answered.size else 1
+
+
+def load_tables(store, faculty=None, term=None):
+    """One ScoreTable per form that has stored sheets (optionally one faculty/term)."""
+    return [load_table(store, faculty, term, form) for form in store.forms(faculty, term)]
+
+
+def build_report(store, faculty=None, term=None):
+    """
+    Summaries of every form with stored sheets: a list of (table, summaries)
+    pairs (see load_tables and summarize), the input of the export functions.
+    Forms without any answered question are left out.
+    """
+    report = []
+    for table in load_tables(store, faculty, term):
+        summaries = summarize(table)
+        if summaries:
+            report.append((table, summaries))
+    return report
+
+
+def form_labels(form_id):
+    """
+    (name, section titles, questions) of a form from its template; a form
+    that is no longer in forms/ is labeled by its id and section names.
+    """
+    try:
+        form = get_template(form_id)
+    except KeyError:
+        return str(form_id), {}, {}
+    return form.name, form.titles, form.questions
+
+def summarize(table, scale=None, percentiles=PERCENTILES):
+    """
+    Aggregate a ScoreTable per faculty member. Everything is computed on
+    the whole array at once (grouped sums with np.add.reduceat, score
+    counts with one np.bincount); only the percentiles loop, once per
+    faculty member.
+
+    Scores outside 1..scale (default: the table's scale) can not be an
+    answer on the form, e.g. a sheet stored from a grid with an extra
+    column; they are left out of every count, mean and total and only
+    reported as "out_of_range".
+
+    Returns:
+      a list of dicts, one per faculty member (sorted by name), with:
+        - "faculty", "sheets": name and number of sheets
+        - "question_means": (sections x rows) mean score per question
+        - "responses": (sections x rows) number of answers per question
+        - "distribution": (sections x rows x scale) count of every score 1..scale
+        - "out_of_range": (sections x rows) number of scores left out
+        - "section_means": mean section total per section
+        - "section_percentiles": {p: per-section percentile of the totals}
+        - "overall_mean": mean of all answered questions
+    """
+    n_sheets, n_sections, n_rows = table.scores.shape
+    if n_sheets == 0:
+        return []
+    scale = table.scale if scale is None else scale
+
+    names, group = np.unique(table.faculty.astype(str), return_inverse=True)
+    order = np.argsort(group, kind="stable")
+    starts = np.r_[0, np.flatnonzero(np.diff(group[order])) + 1]
+    sizes = np.diff(np.r_[starts, n_sheets])
+
+    scores = table.scores[order]
+    stored = ~np.isnan(scores)
+    with np.errstate(invalid="ignore"):
+        answered = stored & (scores >= 1) & (scores <= scale)
+    out_of_range = np.add.reduceat((stored & ~answered).astype(np.int64), starts, axis=0)
+    filled = np.where(answered, scores, 0.0)
+
+    sums = np.add.reduceat(filled, starts, axis=0)
+    responses = np.add.reduceat(answered.astype(np.int64), starts, axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        question_means = sums / responses
+
+    # Count every (faculty, section, row, score) combination in one pass.
+    sheet_group = np.repeat(np.arange(len(names)), sizes)[:, None, None]
+    cell = (sheet_group * n_sections + np.arange(n_sections)[None, :, None]) * n_rows \
+        + np.arange(n_rows)[None, None, :]
+    values = filled.astype(np.int64) - 1
+    flat = (np.broadcast_to(cell, scores.shape) * scale + values)[answered]
+    distribution = np.bincount(flat, minlength=len(names) * n_sections * n_rows * scale)
+    distribution = distribution.reshape(len(names), n_sections, n_rows, scale)
+
+    # Section total per sheet (sheets without the section are left out).
+    has_section = answered.any(axis=2)
+    totals = np.where(has_section, filled.sum(axis=2), np.nan)
+    section_counts = np.add.reduceat(has_section.astype(np.int64), starts, axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        section_means = np.add.reduceat(np.nan_to_num(totals), starts, axis=0) / section_counts
+        overall_means = sums.sum(axis=(1, 2)) / responses.sum(axis=(1, 2))
+
+    summaries = []
+    for g, name in enumerate(names):
+        group_totals = totals[starts[g]:starts[g] + sizes[g]]
+        with warnings.catch_warnings():
+            # Sections no sheet of this faculty member has give NaN.
+            warnings.simplefilter("ignore", RuntimeWarning)
+            section_percentiles = np.nanpercentile(group_totals, percentiles, axis=0)
+        summaries.append({
+            "faculty": str(name),
+            "sheets": int(sizes[g]),
+            "question_means": question_means[g],
+            "responses": responses[g],
+            "distribution": distribution[g],
+            "out_of_range": out_of_range[g],
+            "section_means": section_means[g],
+            "section_percentiles": dict(zip(percentiles, section_percentiles)),
+            "overall_mean": float(overall_means[g]),
+        })
+    return summaries
+
+
+def _fmt(value):
+    return "" if value is None or np.isnan(value) else f"{value:.2f}"
+
+
+def export_csv(report, path, percentiles=PERCENTILES):
+    """
+    Write a report (build_report) as CSV: one line per form, faculty
+    member, section and question, followed by a "Total" line per section
+    with the percentiles of the section totals. There is a count column
+    for every score of the widest scale in the report; forms with a
+    shorter scale leave the extra ones empty.
+    """
+    scale = max((table.scale for table, _ in report), default=1)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["form", "faculty", "sheets", "section", "question", "responses", "mean"]
+                        + [f"count_{v}" for v in range(1, scale + 1)]
+                        + ["out_of_range"] + [f"p{p}" for p in percentiles])
+        for table, summaries in report:
+            padding = [""] * (scale - table.scale)
+            for summary in summaries:
+                lead = [table.form, summary["faculty"], summary["sheets"]]
+                for s, section in enumerate(table.sections):
+                    for r in range(summary["question_means"].shape[1]):
+                        if summary["responses"][s, r] == 0 and summary["out_of_range"][s, r] == 0:
+                            continue
+                        writer.writerow(lead + [section, r + 1,
+                                                int(summary["responses"][s, r]),
+                                                _fmt(summary["question_means"][s, r])]
+                                        + [int(c) for c in summary["distribution"][s, r]]
+                                        + padding + [int(summary["out_of_range"][s, r])]
+                                        + [""] * len(percentiles))
+                    writer.writerow(lead + [section, "Total", "",
+                                            _fmt(summary["section_means"][s])]
+                                    + [""] * (scale + 1)
+                                    + [_fmt(summary["section_percentiles"][p][s])
+                                       for p in percentiles])
+
+
+def export_html(report, path, title="CNSC Teacher Evaluation Report", percentiles=PERCENTILES):
+    """
+    Write a printable HTML report (one page per form and faculty member when
+    printed): per-question means and score counts, and the section totals.
+    Section titles and questions come from each form's template.
+    """
+    esc = html.escape
+    parts = [
+        "<!DOCTYPE html><html><head><meta charset='utf-8'>",
+        f"<title>{esc(title)}</title>",
+        "<style>body{font-family:Montserrat,Arial,sans-serif;margin:2em}"
+        "h1,h2{color:#800000}table{border-collapse:collapse;width:100%;margin-bottom:1.5em}"
+        "th,td{border:1px solid #999;padding:4px 6px;font-size:12px}th{background:#f3e5e5}"
+        "td.n{text-align:right}.faculty{page-break-after:always}"
+        "@media print{body{margin:0}}</style></head><body>",
+        f"<h1>{esc(title)}</h1>",
+    ]
+    for table, summaries in report:
+        form_name, section_titles, section_questions = form_labels(table.form)
+        for summary in summaries:
+            parts.append("<div class='faculty'>")
+            parts.append(f"<h2>{esc(summary['faculty'])}</h2>")
+            parts.append(f"<p>{esc(form_name)}: {summary['sheets']} sheet(s), overall mean "
+                         f"{_fmt(summary['overall_mean'])}</p>")
+            for s, section in enumerate(table.sections):
+                if not summary["responses"][s].any():
+                    continue
+                parts.append(f"<h3>{esc(section_titles.get(section, section))}</h3>")
+                parts.append("<table><tr><th>#</th><th>Question</th><th>Responses</th>"
+                             "<th>Mean</th>"
+                             + "".join(f"<th>{v}</th>" for v in range(table.scale, 0, -1))
+                             + "</tr>")
+                for r in range(summary["question_means"].shape[1]):
+                    if summary["responses"][s, r] == 0:
+                        continue
+                    question = section_questions.get(section, {}).get(r + 1, f"Row {r + 1}")
+                    counts = summary["distribution"][s, r][::-1]
+                    parts.append(f"<tr><td>{r + 1}</td><td>{esc(question)}</td>"
+                                 f"<td class='n'>{summary['responses'][s, r]}</td>"
+                                 f"<td class='n'>{_fmt(summary['question_means'][s, r])}</td>"
+                                 + "".join(f"<td class='n'>{c}</td>" for c in counts) + "</tr>")
+                stats = ", ".join(f"p{p} {_fmt(summary['section_percentiles'][p][s])}"
+                                  for p in percentiles)
+                parts.append(f"</table><p>Section total: mean "
+                             f"{_fmt(summary['section_means'][s])} ({stats})</p>")
+                dropped = int(summary["out_of_range"][s].sum())
+                if dropped:
+                    parts.append(f"<p>{dropped} score(s) outside 1-{table.scale} left out.</p>")
+            parts.append("</div>")
+    parts.append("</body></html>")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(parts))
+
+
+def format_summary(report):
+    """Plain-text overview of a report (for the Print page and the command line)."""
+    lines = []
+    for table, summaries in report:
+        form_name, section_titles, _ = form_labels(table.form)
+        lines.append(f"== {form_name} ==")
+        for summary in summaries:
+            line = (f"{summary['faculty']}: {summary['sheets']} sheet(s), "
+                    f"overall mean {_fmt(summary['overall_mean'])}")
+            dropped = int(summary["out_of_range"].sum())
+            if dropped:
+                line += f" ({dropped} score(s) outside 1-{table.scale} left out)"
+            lines.append(line)
+            for s, section in enumerate(table.sections):
+                if not summary["responses"][s].any():
+                    continue
+                means = ", ".join(_fmt(m) for m in summary["question_means"][s]
+                                  if not np.isnan(m))
+                lines.append(f"  {section_titles.get(section, section)}: total "
+                             f"{_fmt(summary['section_means'][s])} (median "
+                             f"{_fmt(summary['section_percentiles'][50][s])}), "
+                             f"question means {means}")
+            lines.append("")
+    return "\n".join(lines)
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Summarize the stored TER scores per faculty member.")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH,
+                        help=f"results database (default: {DEFAULT_DB_PATH})")
+    parser.add_argument("--faculty", help="only this faculty member")
+    parser.add_argument("--term", help="only this evaluation term")
+    parser.add_argument("--csv", help="write the summary as CSV to this file")
+    parser.add_argument("--html", help="write a printable HTML report to this file")
+    args = parser.parse_args(argv)
+
+    store = ResultStore(args.db)
+    try:
+        report = build_report(store, args.faculty, args.term)
+    finally:
+        store.close()
+    if not report:
+        print("No scored sheets found.", file=sys.stderr)
+        return 1
+
+    print(format_summary(report))
+    if args.csv:
+        export_csv(report, args.csv)
+    if args.html:
+        export_html(report, args.html)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
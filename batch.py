@@ -0,0 +1,365 @@
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import collections
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import cv2
+import main  # process_sections(img) does the actual scoring
+import instrument
+from layout import LayoutCache
+from loader import MULTI_PAGE_EXTENSIONS, is_multi_page, iter_pages, load_scan
+from store import ResultStore
+from cache import DEFAULT_CACHE_DIR, ResultCache, file_fingerprint, image_key
+from profiles import fingerprint, get_profile
+from template import get_template
+from identify import identify_form
+
+# Sheets written to the results database per transaction.
+DB_BATCH_SIZE = 100
+
+# File types the batch scorer picks up when given a directory.
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp") + MULTI_PAGE_EXTENSIONS
+
+# Grid layout and result caches, the scanner profile and the form (None:
+# identify every sheet's form) of this (worker) process, set up by init_worker.
+# _layout_key is the hash of the layout file, part of every result cache key;
+# _table is the table argument of process_sections (None: from the profile).
+_layout_cache = None
+_layout_key = None
+_table = None
+_result_cache = None
+_profile = None
+_form = None
+
+
+def expand_paths(patterns):
+    """
+    Expand a list of files, directories and glob patterns into a sorted
+    list of image paths. Directories are searched (non-recursively) for
+    files with one of the IMAGE_EXTENSIONS.
+    """
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for name in sorted(os.listdir(pattern)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    paths.append(os.path.join(pattern, name))
+        elif os.path.isfile(pattern):
+            paths.append(pattern)
+        else:
+            paths.extend(sorted(glob.glob(pattern)))
+
+    # Drop duplicates while keeping the order.
+    seen = set()
+    unique = []
+    for path in paths:
+        key = os.path.abspath(path)
+        if key not in seen:
+            seen.add(key)
+            unique.append(path)
+    return unique
+
+
+def iter_sources(paths):
+    """
+    Turn image paths into score_file sources: single images are passed on
+    as paths, while every page of a multi-page TIFF/PDF is decoded here (as
+    iter_sheets asks for it) and passed on as a (name, image) pair. A
+    container that cannot be read gives one (path, error) pair.
+    """
+    for path in paths:
+        if not is_multi_page(path):
+            yield path
+            continue
+        try:
+            for page in iter_pages(path):
+                yield page
+        except Exception as e:
+            yield path, e
+
+
+def score_file(source):
+    """
+    Load a single scanned sheet, tell which form revision it is printed on
+    (identify.identify_form, unless init_worker was given a form) and score
+    it with main.process_sections against that form's template.
+
+    Runs inside a worker process, so it only returns plain data: the
+    section images drawn by the detectors are dropped to keep the result
+    cheap to send back to the parent process.
+
+    Input:
+      source: the path of an image file, or a (name, image) pair for a sheet
+              that is already decoded (e.g. a page of a multi-page scan).
+              Decoded sheets skip the result cache. A (name, exception)
+              pair is reported as a failed sheet.
+
+    Returns:
+      a dict with "path" (the path or name), "form" (the id of the form
+      the sheet was scored as), "sections" (section name -> row_scores,
+      total_score, total_columns, answers and, from the fill scorer,
+      confidence), "cached" (True if the result came from the result
+      cache) and "error" (None on success; a sheet that matches no known
+      form, or with a section whose grid does not have the form's rows and
+      columns, is an error rather than being stored with wrong scores).
+    """
+    if isinstance(source, tuple):
+        path, img = source
+    else:
+        path, img = source, None
+    form = _form
+    corners = None
+    try:
+        if isinstance(img, Exception):
+            raise img
+        with instrument.sheet(path):
+            key = None
+            if _result_cache is not None and img is None:
+                key = image_key(path, profile=fingerprint(_profile),
+                                form=form.id if form is not None else None, layout=_layout_key)
+                sections, form_id = _result_cache.get(key)
+                instrument.count("cache_hits" if sections is not None else "cache_misses")
+                if sections is not None:
+                    return {"path": path, "form": form_id, "sections": sections,
+                            "cached": True, "error": None}
+
+            if img is None:
+                with instrument.timer("load_scan"):
+                    img = load_scan(path)
+            if form is None:
+                # Mixed stacks: every sheet is scored against its own form.
+                with instrument.timer("identify_form"):
+                    form, distance, corners = identify_form(img)
+                if form is None:
+                    instrument.count("form_unknown")
+                    raise ValueError(f"form not recognized (closest signature differs "
+                                     f"by {distance} bits)")
+            results = main.process_sections(img, layout_cache=_layout_cache, profile=_profile,
+                                            table=_table, template=form, corners=corners)
+            # A section read from a wrong grid is a failed sheet, not a score.
+            errors = main.section_errors(results)
+            if errors:
+                raise ValueError("; ".join(errors))
+
+        sections = main.plain_results(results)
+        if key is not None:
+            _result_cache.put(key, sections, form.id)
+        return {"path": path, "form": form.id, "sections": sections, "cached": False,
+                "error": None}
+    except Exception as e:
+        return {"path": path, "form": form.id if form is not None else None, "sections": {},
+                "cached": False, "error": str(e)}
+
+
+def score_path(path):
+    """
+    Score every sheet in one file inside a worker process: the file itself,
+    or each page of a multi-page TIFF/PDF.
+
+    Returns:
+      a list of score_file results, one per sheet.
+    """
+    if not is_multi_page(path):
+        return [score_file(path)]
+    return [score_file(source) for source in iter_sources([path])]
+
+
+def init_worker(layout_path=None, cache_dir=None, trace_path=None, verbose=False, profile=None,
+                form=None):
+    """
+    ProcessPoolExecutor initializer: set up the caches, sinks, scanner
+    profile (detector settings from profiles.get_profile; the default
+    profile when None) and form (a form id to score every sheet as; None
+    identifies the form of each sheet) of a worker process.
+    """
+    global _layout_cache, _layout_key, _table, _result_cache, _profile, _form
+    # Every process already gets its own core; stop OpenCV from starting
+    # a thread per core inside each of them as well.
+    cv2.setNumThreads(1)
+    # Each process learns the grid from its first good sheet, or starts from
+    # a calibrated layout file (see layout.py).
+    _layout_cache = LayoutCache(layout_path)
+    # Grids from the file decide scores, so the file is part of the cache key.
+    _layout_key = file_fingerprint(layout_path)
+    # The cached grids are per section; whole-table mode would never read them.
+    _table = False if layout_path else None
+    # Sheets scored before (same file bytes, same pipeline) are not redone.
+    _result_cache = ResultCache(cache_dir) if cache_dir else None
+    _profile = profile or get_profile()
+    _form = get_template(form) if form else None
+    # Timings and counters of every sheet (see instrument.py).
+    if trace_path:
+        instrument.add_sink(instrument.JsonLinesSink(trace_path))
+    if verbose:
+        instrument.add_sink(instrument.ConsoleSink())
+
+
+def iter_sheets(sources, workers=None, prefetch=None, ordered=True, verbose=False,
+                layout_path=None, cache_dir=None, trace_path=None, profile=None, form=None):
+    """
+    Score a stream of sheets on a process pool and lazily yield one result
+    (see score_file) per sheet.
+
+    Sources are pulled from the iterable only as fast as the pool works
+    through them: at most workers + prefetch sheets are queued or being
+    scored at any time, so memory stays flat however many sheets (or
+    decoded pages) the iterable produces. Each worker loads and scores its
+    sheet while the caller handles the results already yielded.
+
+    Input:
+      sources: iterable of image paths and/or (name, image) pairs.
+      workers: worker processes (default: all cores).
+      prefetch: sheets queued beyond the ones being scored (default: workers).
+      ordered: yield in input order (default); False yields each result as
+               soon as it is ready.
+      profile: detector settings of a scanner profile (profiles.get_profile).
+      form: id of the form every sheet is printed on; None (default)
+            identifies the form of each sheet, so mixed stacks need no sorting.
+    """
+    workers = workers or os.cpu_count()
+    max_pending = workers + (workers if prefetch is None else prefetch)
+    sources = iter(sources)
+    pending = collections.deque()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(layout_path, cache_dir, trace_path, verbose,
+                                       profile, form)) as executor:
+        def submit_next():
+            for source in sources:
+                pending.append(executor.submit(score_file, source))
+                return True
+            return False
+
+        try:
+            while len(pending) < max_pending and submit_next():
+                pass
+            while pending:
+                if ordered:
+                    future = pending.popleft()
+                else:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    future = done.pop()
+                    pending.remove(future)
+                result = future.result()
+                # Refill the queue before handing the result to the caller.
+                submit_next()
+                yield result
+        finally:
+            # The caller stopped early: drop the sheets not started yet.
+            for future in pending:
+                future.cancel()
+
+
+def format_result(result):
+    """One line summary of a sheet for the console."""
+    if result["error"] is not None:
+        return f"{result['path']}: FAILED ({result['error']})"
+    totals = ", ".join(
+        f"{sec}={data['total_score']}" for sec, data in result["sections"].items()
+    )
+    return f"{result['path']} ({result['form']}): {totals}"
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Score a folder of scanned TER sheets without the dashboard."
+    )
+    parser.add_argument("paths", nargs="+",
+                        help="image files (multi-page TIFF/PDF included), directories or "
+                             "glob patterns (e.g. 'scans/*.jpg')")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="number of worker processes (default: all cores)")
+    parser.add_argument("--prefetch", type=int, default=None,
+                        help="sheets queued ahead of the workers (default: one per worker)")
+    parser.add_argument("-o", "--output",
+                        help="write one JSON line per sheet to this file")
+    parser.add_argument("--db",
+                        help="store the scores in this SQLite results database")
+    parser.add_argument("--faculty", help="faculty member the sheets are for (stored with --db)")
+    parser.add_argument("--term", help="evaluation term, e.g. '2025-1' (stored with --db)")
+    parser.add_argument("-l", "--layout",
+                        help="calibrated grid layout file (see layout.py); the sections "
+                             "are then read one by one, not as a whole table")
+    parser.add_argument("-p", "--profile",
+                        help="scanner profile from profiles.json (default: $TER_PROFILE "
+                             "or 'default')")
+    parser.add_argument("-f", "--form",
+                        help="score every sheet as this form (see template.py) instead of "
+                             "identifying the form of each sheet")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help=f"result cache folder (default: {DEFAULT_CACHE_DIR})")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="score every sheet again, ignoring the result cache")
+    parser.add_argument("--trace",
+                        help="append per-stage timings and counters as JSON lines to this file")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="show the counters and per-section scores of every sheet")
+    args = parser.parse_args(argv)
+
+    try:
+        profile = get_profile(args.profile)
+        if args.form:
+            get_template(args.form)
+    except KeyError as e:
+        print(e.args[0], file=sys.stderr)
+        return 1
+
+    paths = expand_paths(args.paths)
+    if not paths:
+        print("No images found.", file=sys.stderr)
+        return 1
+
+    workers = args.workers or os.cpu_count()
+    print(f"Scoring {len(paths)} file(s) on {workers} worker(s)...", file=sys.stderr)
+    # Containers hold an unknown number of sheets until they are read.
+    total = "" if any(is_multi_page(path) for path in paths) else f"/{len(paths)}"
+
+    cache_dir = None if args.no_cache else args.cache_dir
+    out = open(args.output, "w", encoding="utf-8") if args.output else None
+    store = ResultStore(args.db) if args.db else None
+    pending = []  # scored sheets not yet written to the database
+    done = 0
+    failed = 0
+    cached = 0
+    start = time.perf_counter()
+    try:
+        results = iter_sheets(iter_sources(paths), workers, args.prefetch, verbose=args.verbose,
+                              layout_path=args.layout, cache_dir=cache_dir,
+                              trace_path=args.trace, profile=profile, form=args.form)
+        for result in results:
+            done += 1
+            if result["error"] is not None:
+                failed += 1
+            elif result["cached"]:
+                cached += 1
+            print(f"[{done}{total}] {format_result(result)}", flush=True)
+            if out is not None:
+                out.write(json.dumps(result) + "\n")
+                out.flush()
+            if store is not None and result["error"] is None:
+                pending.append((result["sections"], result["path"], args.faculty, args.term,
+                                result["form"]))
+                if len(pending) >= DB_BATCH_SIZE:
+                    store.add_sheets(pending)
+                    pending = []
+    finally:
+        if out is not None:
+            out.close()
+        if store is not None:
+            if pending:
+                store.add_sheets(pending)
+            store.close()
+    elapsed = time.perf_counter() - start
+
+    rate = done / elapsed if elapsed > 0 else 0.0
+    print(f"Scored {done - failed} sheet(s) ({cached} from cache), {failed} failed, "
+          f"in {elapsed:.1f}s ({rate:.2f} sheets/s)", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
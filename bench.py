@@ -0,0 +1,284 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+import cv2
+import numpy as np
+import main
+import instrument
+from identify import identify_form
+from loader import decode_scan, page_size
+
+# Sheet the synthetic corpus is generated from.
+DEFAULT_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scan2.jpg")
+
+# Synthetic variants: every scale (of the source resolution) at every rotation.
+CORPUS_SCALES = (1.0, 0.5, 0.25)
+CORPUS_ROTATIONS = (0.0, -2.0, 2.0)  # degrees
+CORPUS_JPEG_QUALITY = 90
+
+# Baseline file written by --save-baseline and checked on every run.
+DEFAULT_BASELINE = "bench_baseline.json"
+
+# A stage regresses when its median is this much slower than the baseline...
+DEFAULT_TOLERANCE = 0.25
+# ...and by more than this many milliseconds (timer noise on the tiny stages).
+MIN_REGRESSION_MS = 1.0
+
+# Runs of the fixed reference workload that measures how fast this machine
+# is right now; baselines are scaled by it before comparing.
+REFERENCE_RUNS = 20
+
+# Stages timed for every sheet, in pipeline order (the instrument.py timer
+# names; detectors that run once per section are summed over the sheet).
+# The per-section line finders and detect_circles only run when the table
+# does not split or with the hough scorer, so they are usually 0. "total"
+# is the full decode to scores run that the throughput is computed from.
+STAGES = ("decode", "resize", "identify_form", "align", "preprocess", "detect_table_grid",
+          "detect_horizontal_lines", "detect_vertical_lines", "detect_grid_projection",
+          "detect_circles", "scoring", "total")
+
+
+def build_corpus(source, directory, scales=CORPUS_SCALES, rotations=CORPUS_ROTATIONS):
+    """
+    Write the synthetic corpus: the source sheet at every scale and rotation,
+    saved as JPEG so decoding is part of the benchmark.
+
+    Returns:
+      the list of written paths.
+    """
+    img = cv2.imread(source)
+    if img is None:
+        raise ValueError(f"Could not read {source}")
+
+    paths = []
+    for scale in scales:
+        scaled = img if scale == 1.0 else cv2.resize(img, None, fx=scale, fy=scale,
+                                                     interpolation=cv2.INTER_AREA)
+        height, width = scaled.shape[:2]
+        for angle in rotations:
+            variant = scaled
+            if angle:
+                matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+                variant = cv2.warpAffine(scaled, matrix, (width, height),
+                                         borderMode=cv2.BORDER_REPLICATE)
+            name = f"{os.path.splitext(os.path.basename(source))[0]}_{width}x{height}_r{angle:+g}.jpg"
+            path = os.path.join(directory, name)
+            cv2.imwrite(path, variant, [cv2.IMWRITE_JPEG_QUALITY, CORPUS_JPEG_QUALITY])
+            paths.append(path)
+    return paths
+
+
+class StageSink:
+    """instrument.py sink adding up the seconds of every timer by stage."""
+
+    def __init__(self):
+        self.seconds = {}
+
+    def write(self, record):
+        if record["type"] == "timer":
+            self.seconds[record["name"]] = self.seconds.get(record["name"], 0.0) + record["ms"] / 1000.0
+
+
+def time_sheet(path):
+    """
+    Score one sheet the way batch.score_file does (load_scan, identify_form,
+    then process_sections with the default settings) and time each stage.
+
+    The stage times are the instrument.py timers of that very run, so they
+    always match what the pipeline does; load_scan is split into its decode
+    and resize steps here.
+
+    Returns:
+      a dict mapping every name in STAGES -> seconds (0.0 for stages that
+      did not run on this sheet).
+    """
+    sink = instrument.add_sink(StageSink())
+    try:
+        start = time.perf_counter()
+        with instrument.timer("decode"):
+            decoded = decode_scan(path)
+        with instrument.timer("resize"):
+            img = cv2.resize(decoded, page_size(), interpolation=cv2.INTER_AREA)
+        with instrument.timer("identify_form"):
+            form, _, corners = identify_form(img)
+        main.process_sections(img, template=form, corners=corners)
+        total = time.perf_counter() - start
+    finally:
+        instrument.remove_sink(sink)
+
+    timings = {stage: sink.seconds.get(stage, 0.0) for stage in STAGES}
+    timings["total"] = total
+    return timings
+
+
+def reference_ms(runs=REFERENCE_RUNS):
+    """
+    Fastest time of a fixed OpenCV workload (blur, threshold and morphology
+    on a constant image), used to tell a slower pipeline from a slower
+    machine. The minimum is far less noisy than the median on a busy box.
+    """
+    img = np.random.default_rng(0).integers(0, 256, (2000, 1600), dtype=np.uint8)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (15, 1))
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        blurred = cv2.GaussianBlur(img, (5, 5), 0)
+        _, binary = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        cv2.morphologyEx(binary, cv2.MORPH_OPEN, kernel)
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000.0
+
+
+def run_benchmark(paths, repeat=5, warmup=1):
+    """
+    Time every sheet `repeat` times (after `warmup` untimed runs of the
+    first sheet).
+
+    Returns:
+      a report dict: "sheets", "runs", "throughput" (sheets/s, from the
+      "total" stage), "reference_ms" (see reference_ms) and "stages"
+      mapping stage -> p50/p90/p99/mean in ms.
+    """
+    for _ in range(warmup):
+        time_sheet(paths[0])
+
+    samples = {stage: [] for stage in STAGES}
+    references = []
+    for _ in range(repeat):
+        references.append(reference_ms())
+        for path in paths:
+            for stage, seconds in time_sheet(path).items():
+                samples[stage].append(seconds * 1000.0)
+
+    stages = {}
+    for stage, values in samples.items():
+        values = np.asarray(values)
+        p50, p90, p99 = np.percentile(values, [50, 90, 99])
+        stages[stage] = {"p50": round(float(p50), 3), "p90": round(float(p90), 3),
+                         "p99": round(float(p99), 3), "mean": round(float(values.mean()), 3)}
+
+    total_seconds = sum(samples["total"]) / 1000.0
+    return {
+        "sheets": len(paths),
+        "runs": len(samples["total"]),
+        "throughput": round(len(samples["total"]) / total_seconds, 2),
+        "reference_ms": round(min(references), 3),
+        "stages": stages,
+    }
+
+
+def compare(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compare the median of every stage with the baseline, after scaling the
+    baseline by how much slower (or faster) the reference workload ran.
+
+    Returns:
+      a list of (stage, baseline_ms, current_ms) for the stages that
+      regressed by more than tolerance (and MIN_REGRESSION_MS).
+    """
+    speed = machine_factor(report, baseline)
+    regressions = []
+    for stage, stats in report["stages"].items():
+        base = baseline.get("stages", {}).get(stage)
+        if base is None:
+            continue
+        expected = base["p50"] * speed
+        limit = max(expected * (1 + tolerance), expected + MIN_REGRESSION_MS)
+        if stats["p50"] > limit:
+            regressions.append((stage, expected, stats["p50"]))
+    return regressions
+
+
+def machine_factor(report, baseline):
+    """Reference time of this run relative to the baseline's (1.0 if unknown)."""
+    current, base = report.get("reference_ms"), baseline.get("reference_ms")
+    if not current or not base:
+        return 1.0
+    return current / base
+
+
+def format_report(report, baseline=None):
+    lines = [f"{report['sheets']} sheet(s), {report['runs']} run(s), "
+             f"{report['throughput']} sheets/s, reference {report['reference_ms']:.2f} ms"]
+    speed = 1.0
+    header = f"{'stage':<26}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}"
+    if baseline is not None:
+        speed = machine_factor(report, baseline)
+        lines.append(f"Baseline scaled by {speed:.2f} for machine speed")
+        header += f"{'base p50':>10}{'change':>9}"
+    lines.append(header)
+    for stage, stats in report["stages"].items():
+        line = f"{stage:<26}{stats['p50']:>10.2f}{stats['p90']:>10.2f}{stats['p99']:>10.2f}"
+        base = None if baseline is None else baseline.get("stages", {}).get(stage)
+        if base is not None and base["p50"] > 0:
+            expected = base["p50"] * speed
+            change = (stats["p50"] - expected) / expected * 100
+            line += f"{expected:>10.2f}{change:>+8.0f}%"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the OMR pipeline stage by stage on a corpus of sheets.")
+    parser.add_argument("images", nargs="*",
+                        help="sheets to benchmark (default: synthetic variants of scan2.jpg)")
+    parser.add_argument("-r", "--repeat", type=int, default=5,
+                        help="timed runs per sheet (default: 5)")
+    parser.add_argument("-b", "--baseline", default=DEFAULT_BASELINE,
+                        help=f"baseline to check against (default: {DEFAULT_BASELINE})")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="write this run as the new baseline instead of checking it")
+    parser.add_argument("-t", "--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"allowed slowdown of a stage's median (default: {DEFAULT_TOLERANCE})")
+    parser.add_argument("-o", "--output", help="also write the report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    # Stage timings are per thread; keep OpenCV from fanning out internally
+    # so runs are comparable between machines with different core counts.
+    cv2.setNumThreads(1)
+
+    corpus_dir = None
+    paths = args.images
+    if not paths:
+        corpus_dir = tempfile.mkdtemp(prefix="ter_bench_")
+        paths = build_corpus(DEFAULT_SOURCE, corpus_dir)
+    try:
+        report = run_benchmark(paths, repeat=args.repeat)
+    finally:
+        if corpus_dir is not None:
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(format_report(report))
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print(format_report(report, baseline))
+    if baseline is None:
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one.")
+        return 0
+
+    regressions = compare(report, baseline, args.tolerance)
+    for stage, base_ms, current_ms in regressions:
+        print(f"REGRESSION {stage}: {base_ms:.2f} ms -> {current_ms:.2f} ms")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,159 @@
+import os
+import sys
+import json
+import hashlib
+import functools
+
+# Default cache folder, next to the results database in the user's home.
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cnsc_ter_cache")
+
+# Least recently used entries are evicted once the folder grows past this.
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Size check (a scan of the whole folder) after this many writes.
+EVICT_EVERY = 50
+
+# Modules whose code (and hard-coded parameters) decide the scores. Editing
+# any of them gives every image a new cache key. The scanner profile and
+# calibrated layout file in use are part of the key as well (see image_key).
+# Frozen builds ship no sources; there the executable, which holds the
+# bytecode of every module, is hashed instead.
+PIPELINE_MODULES = ("loader.py", "align.py", "utils.py", "layout.py", "scoring.py", "main.py",
+                    "profiles.py", "template.py", "identify.py")
+
+# Folder of the form definitions (template.py); a changed form changes the
+# scores of its sheets just like changed code does.
+FORMS_DIR = "forms"
+
+
+@functools.lru_cache(maxsize=None)
+def pipeline_fingerprint():
+    """
+    Hash of the pipeline code (the source of the PIPELINE_MODULES, or the
+    executable of a frozen build) and the form definitions (computed once
+    per process).
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    if getattr(sys, "frozen", False):
+        # PyInstaller: the modules are bytecode in the executable's archive,
+        # so a new release is a new executable (and a new key).
+        _hash_file(digest, sys.executable)
+    else:
+        for name in PIPELINE_MODULES:
+            _hash_file(digest, os.path.join(base_dir, name))
+    forms_dir = os.path.join(base_dir, FORMS_DIR)
+    if os.path.isdir(forms_dir):
+        for name in sorted(os.listdir(forms_dir)):
+            digest.update(name.encode())
+            _hash_file(digest, os.path.join(forms_dir, name))
+    return digest.hexdigest()
+
+
+def file_fingerprint(path):
+    """Hash of a file's bytes (e.g. a --layout file), or None when path is None."""
+    if path is None:
+        return None
+    digest = hashlib.blake2b(digest_size=16)
+    _hash_file(digest, path)
+    return digest.hexdigest()
+
+
+def _hash_file(digest, path):
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    except OSError:
+        # A missing file hashes as its name (e.g. a layout file not written yet).
+        digest.update(os.path.basename(path).encode())
+
+
+def image_key(path, **params):
+    """
+    Cache key of an image: hash of the file bytes, the pipeline code and the
+    process_sections parameters it is scored with.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    digest.update(pipeline_fingerprint().encode())
+    digest.update(repr(sorted(params.items())).encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    On-disk cache of scored sheets: one small JSON file per image key
+    holding the output of main.plain_results and the id of the form the
+    sheet was scored as.
+
+    Hits refresh the file's modification time, and every EVICT_EVERY writes
+    the oldest files are evicted until the folder is within max_bytes, so
+    the cache behaves as a size-bounded LRU. Safe to share between
+    processes: files are written to a temporary name and renamed into place.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key):
+        """Return the cached (sections, form id) for key, or (None, None)."""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None, None
+        sections = entry["sections"]
+
+        # JSON turned the row numbers into strings.
+        for data in sections.values():
+            data["row_scores"] = {int(row): score for row, score in data["row_scores"].items()}
+            if "confidence" in data:
+                data["confidence"] = {int(row): c for row, c in data["confidence"].items()}
+        return sections, entry.get("form")
+
+    def put(self, key, sections, form=None):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"form": form, "sections": sections}, f)
+        os.replace(tmp_path, path)
+        self._writes += 1
+        if self._writes % EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        """Delete the least recently used entries until within max_bytes."""
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        if total <= self.max_bytes:
+            return
+
+        entries.sort()
+        for _, size, path in entries:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= self.max_bytes:
+                break
@@ -0,0 +1,219 @@
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+
+import cv2
+import main
+from loader import load_scan
+from profiles import DEFAULT_PROFILES_PATH, get_profile, merge_params, save_profile
+
+# Values tried for every detector setting (keys are paths into the
+# profile). The grid finder decides the grid (and so the scores) of the
+# default fill scorer: in table mode (utils.detect_table_grid) that is the
+# projection settings, section by section the line detectors, so those
+# candidates switch table mode off. The circle settings only matter with
+# --scorer hough.
+TABLE_SEARCH_SPACE = {
+    ("projection", "min_rule_length"): (10, 15, 25),
+    ("projection", "min_coverage"): (0.2, 0.3, 0.4),
+    ("projection", "column_drift"): (2, 4, 8),
+    ("merge_distance",): (6, 10, 14),
+}
+LINE_SEARCH_SPACE = {
+    ("grid", "table"): (False,),
+    ("grid", "method"): ("hough",),
+    ("vertical", "kernel_height"): (30, 40),
+    ("vertical", "threshold"): (6, 15, 30),
+    ("vertical", "max_line_gap"): (50, 300),
+    ("horizontal", "kernel_width"): (25, 40, 60),
+    ("horizontal", "threshold"): (30, 60),
+    ("horizontal", "max_line_gap"): (200, 1000),
+}
+CIRCLE_SEARCH_SPACE = {
+    ("circles", "dp"): (1.2, 1.5, 2.0),
+    ("circles", "param1"): (50, 100),
+    ("circles", "param2"): (20, 30, 40),
+}
+
+# Fraction of labeled rows that must come out right.
+DEFAULT_TARGET = 0.95
+
+
+def load_labels(path):
+    """
+    Read a labeled sample set: a JSON file mapping every scan (relative to
+    the labels file) to the correct answers of its sheet, e.g.
+
+      {"scans/sheet01.jpg": {"Section 1": {"1": 4, "2": 3, ...}, ...}, ...}
+
+    Returns:
+      a list of (image path, {section: {row: score}}) pairs.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    base_dir = os.path.dirname(os.path.abspath(path))
+    samples = []
+    for image, sections in data.items():
+        labels = {sec_name: {int(row): score for row, score in rows.items()}
+                  for sec_name, rows in sections.items()}
+        samples.append((os.path.join(base_dir, image), labels))
+    return samples
+
+
+def count_correct(results, labels):
+    """Number of labeled rows the results got right, and the number of labeled rows."""
+    correct = 0
+    total = 0
+    for sec_name, rows in labels.items():
+        row_scores = results.get(sec_name, {}).get("row_scores", {})
+        for row, score in rows.items():
+            total += 1
+            correct += row_scores.get(row) == score
+    return correct, total
+
+
+def candidates(base, space):
+    """Every combination of the values in space, as full profiles on top of base."""
+    keys = list(space)
+    for values in itertools.product(*(space[key] for key in keys)):
+        changes = {}
+        for key, value in zip(keys, values):
+            group = changes
+            for name in key[:-1]:
+                group = group.setdefault(name, {})
+            group[key[-1]] = value
+        yield changes, merge_params(base, changes)
+
+
+def evaluate(pages, params, scorer="fill", repeat=3):
+    """
+    Score every (aligned page, labels) pair with one set of detector settings.
+
+    Returns:
+      (accuracy, ms, outcome): the fraction of labeled rows scored right,
+      the time per sheet (best of `repeat` runs, so a busy machine does not
+      make a setting look slow) and the grids and scores found, as text
+      (settings that give the same outcome were not told apart).
+    """
+    correct = 0
+    total = 0
+    best = None
+    outcome = []
+    for run in range(repeat):
+        start = time.perf_counter()
+        for page, labels in pages:
+            results = main.process_sections(page, scorer=scorer, align=False, profile=params)
+            if run == 0:
+                page_correct, page_total = count_correct(results, labels)
+                correct += page_correct
+                total += page_total
+                outcome.append({sec_name: (data["y_coords"], data["x_coords"], data["row_scores"])
+                                for sec_name, data in main.plain_results(results).items()})
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return (correct / total if total else 0.0, best * 1000.0 / len(pages),
+            json.dumps(outcome, sort_keys=True))
+
+
+def calibrate(samples, base, space, target=DEFAULT_TARGET, scorer="fill", repeat=3):
+    """
+    Grid search over space, starting from the base profile.
+
+    Returns:
+      (best, trials): best is the (changes, params, accuracy, ms, outcome)
+      trial of the fastest settings that reach the target accuracy (None if
+      none do); trials lists every trial tried.
+    """
+    # Alignment does not depend on the detector settings: do it once.
+    pages = [(main.canonical_page(load_scan(path)), labels) for path, labels in samples]
+
+    trials = []
+    combinations = 1
+    for values in space.values():
+        combinations *= len(values)
+    for index, (changes, params) in enumerate(candidates(base, space), 1):
+        accuracy, ms, outcome = evaluate(pages, params, scorer, repeat)
+        trials.append((changes, params, accuracy, ms, outcome))
+        print(f"[{index}/{combinations}] accuracy {accuracy:.3f}, {ms:.1f} ms/sheet "
+              f"{json.dumps(changes, sort_keys=True)}", flush=True)
+
+    passing = [trial for trial in trials if trial[2] >= target]
+    if not passing:
+        return None, trials
+    # Fastest first; between equally fast settings the more accurate wins.
+    best = min(passing, key=lambda trial: (round(trial[3], 1), -trial[2]))
+    return best, trials
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Find the fastest detector settings that still score a labeled sample "
+                    "set correctly, and save them as a scanner profile.")
+    parser.add_argument("labels", help="labeled sample set (JSON, see load_labels)")
+    parser.add_argument("-n", "--name", help="save the result as this profile")
+    parser.add_argument("--base", default=None,
+                        help="profile the search starts from (default: 'default')")
+    parser.add_argument("--profiles", default=DEFAULT_PROFILES_PATH,
+                        help=f"profiles file (default: {DEFAULT_PROFILES_PATH})")
+    parser.add_argument("-t", "--target", type=float, default=DEFAULT_TARGET,
+                        help=f"fraction of labeled rows that must be right "
+                             f"(default: {DEFAULT_TARGET})")
+    parser.add_argument("--scorer", choices=("fill", "hough"), default="fill",
+                        help="scorer to tune for (hough also searches the circle settings)")
+    parser.add_argument("--grid", choices=("table", "lines"), default=None,
+                        help="grid finder to tune: the whole-table pass or the per-section "
+                             "line detectors (default: the one the base profile uses)")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="timed runs per setting; the best one counts (default: 3)")
+    args = parser.parse_args(argv)
+
+    try:
+        base = get_profile(args.base, args.profiles)
+    except KeyError as e:
+        print(e.args[0], file=sys.stderr)
+        return 1
+    samples = load_labels(args.labels)
+    if not samples:
+        print("The labeled sample set is empty.", file=sys.stderr)
+        return 1
+
+    # Time every setting on one core, as batch.py's worker processes run.
+    cv2.setNumThreads(1)
+    grid = args.grid or ("table" if main.table_mode(profile=base) else "lines")
+    space = dict(TABLE_SEARCH_SPACE if grid == "table" else LINE_SEARCH_SPACE)
+    if args.scorer == "hough":
+        space.update(CIRCLE_SEARCH_SPACE)
+
+    print(f"Searching {len(space)} settings ({grid} grid) on {len(samples)} labeled sheet(s)...")
+    best, trials = calibrate(samples, base, space, args.target, args.scorer, args.repeat)
+    # Settings the grid finder does not read all give the same grids:
+    # picking the "fastest" of those would only be timing noise.
+    if len(trials) > 1 and len({trial[4] for trial in trials}) == 1:
+        print("Every setting gave the same grids and scores; the searched settings "
+              "do not change the result.", file=sys.stderr)
+        return 1
+    start_trial = next((trial for trial in trials if trial[1] == base), None)
+    if start_trial is not None:
+        print(f"Base profile: accuracy {start_trial[2]:.3f}, {start_trial[3]:.1f} ms/sheet")
+    if best is None:
+        top = max(trials, key=lambda trial: trial[2])
+        print(f"No setting reaches {args.target:.3f} accuracy (best: {top[2]:.3f}).",
+              file=sys.stderr)
+        return 1
+
+    changes, params, accuracy, ms, outcome = best
+    print(f"Fastest setting: accuracy {accuracy:.3f}, {ms:.1f} ms/sheet "
+          f"{json.dumps(changes, sort_keys=True)}")
+    if args.name:
+        description = (f"Calibrated on {len(samples)} sheet(s): accuracy {accuracy:.3f}, "
+                       f"{ms:.1f} ms/sheet ({args.scorer} scorer)")
+        save_profile(args.name, params, args.profiles, description)
+        print(f"Saved profile {args.name!r} to {args.profiles}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
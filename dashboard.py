@@ -2,21 +2,34 @@ import os
 import sys
 import customtkinter
 import tkinter
+import webbrowser
+from pathlib import Path
 from tkinter import messagebox, filedialog
-from PIL import Image, ExifTags
-import cv2
-import numpy as np
+from PIL import Image
 from tkinterdnd2 import DND_FILES, TkinterDnD  # requires: pip install tkinterdnd2
-import main  # This module should define process_sections(img)
-
-# Global variable to hold processed results.
-processed_results = None
+from worker import ScanWorker
+import instrument
+import main
+import analytics
+from loader import count_pages, is_multi_page, load_page, load_scan
+from batch import expand_paths
+from store import ResultStore
+from template import get_template
 
 # Colors
 MAROON = "#800000"
 GOLD = "#FFD700"
 WHITE = "#FFFFFF"
 
+# Section titles and questions shown on the Results page and in reports
+# come from the form template (forms/*.json), the same one the scorer uses.
+FORM = get_template()
+SECTION_TITLES = FORM.titles
+SECTION_QUESTIONS = FORM.questions
+
+# Scans processed at the same time by the background worker.
+SCAN_THREADS = min(4, os.cpu_count() or 1)
+
 # Helper function to get absolute path to a resource.
 def resource_path(relative_path):
     """
@@ -29,29 +42,6 @@ def resource_path(relative_path):
         base_path = os.path.dirname(os.path.abspath(__file__))
     return os.path.join(base_path, relative_path)
 
-def fix_orientation(pil_img):
-    try:
-        exif = pil_img._getexif()
-        if exif is None:
-            return pil_img
-
-        # Find the orientation tag
-        for tag, value in ExifTags.TAGS.items():
-            if value == 'Orientation':
-                orientation_tag = tag
-                break
-
-        orientation = exif.get(orientation_tag, None)
-        if orientation == 3:
-            pil_img = pil_img.rotate(180, expand=True)
-        elif orientation == 6:
-            pil_img = pil_img.rotate(270, expand=True)
-        elif orientation == 8:
-            pil_img = pil_img.rotate(90, expand=True)
-    except Exception as e:
-        print("Error fixing orientation:", e)
-    return pil_img
-
 # Load icon safely using absolute paths.
 def load_icon(path, size):
     try:
@@ -62,7 +52,6 @@ def load_icon(path, size):
         return None
 
 def open_dashboard(app):
-    global processed_results
     app.destroy()
 
     # Create the dashboard window using TkinterDnD.Tk for drag-and-drop support.
@@ -111,36 +100,171 @@ def open_dashboard(app):
     )
     default_label.place(relx=0.5, rely=0.5, anchor=tkinter.CENTER)
 
-    # Function to open file dialog and process image.
+    # Background worker: images are decoded and processed off the Tk main
+    # thread, so the window stays responsive while scans are running.
+    # SCAN_THREADS scans run at once and the remaining cores are split
+    # between their sections.
+    # Set TER_TRACE=<file> to log the timings of every scan (instrument.py).
+    # Set TER_PROFILE=<name> to use a scanner profile from profiles.json.
+    instrument.install_from_env()
+    scan_worker = ScanWorker(workers=SCAN_THREADS,
+                             section_workers=max(1, (os.cpu_count() or 1) // SCAN_THREADS))
+    scan_worker.start()
+    scan_jobs = {}     # job id -> {"path", "status", "progress", "finished"}
+    queue_state = {"dirty": True}  # the queue text needs redrawing
+    scan_widgets = {}  # Scan page widgets updated by poll_worker()
+    job_labels = {}    # job id -> (faculty, term) entered when the scan was queued
+    job_sources = {}   # job id -> (path, page); page is None for single images
+    scan_labels = {"faculty": "", "term": ""}  # last faculty/term typed on the Scan page
+
+    # Every processed sheet is saved to the results database.
+    result_store = ResultStore()
+    # Results of the last sheet scanned in this session (no images), so its
+    # overlays can be drawn on demand from the Results page.
+    last_sheet = {"id": result_store.latest_sheet_id(), "source": None, "results": None}
+
+    # Queue image files (and every page of TIFF/PDF batches) for scanning.
+    def queue_files(file_paths):
+        # Faculty and term typed on the Scan page are stored with every sheet.
+        if "faculty" in scan_widgets and scan_widgets["faculty"].winfo_exists():
+            scan_labels["faculty"] = scan_widgets["faculty"].get().strip()
+            scan_labels["term"] = scan_widgets["term"].get().strip()
+        faculty = scan_labels["faculty"] or None
+        term = scan_labels["term"] or None
+        for file_path in file_paths:
+            # Every page of a TIFF/PDF from the document feeder is its own sheet.
+            pages = [None]
+            if is_multi_page(file_path):
+                try:
+                    pages = range(count_pages(file_path))
+                except Exception as e:
+                    messagebox.showerror("Error", f"Failed to open {os.path.basename(file_path)}: {e}")
+                    continue
+            for page in pages:
+                job_id = scan_worker.submit(file_path, page)
+                job_labels[job_id] = (faculty, term)
+                job_sources[job_id] = (file_path, page)
+
+    # Function to open file dialog and queue the selected images.
     def select_image():
-        global processed_results
-        file_path = filedialog.askopenfilename(
-            title="Select an Image",
-            filetypes=[("Image Files", "*.png;*.jpg;*.jpeg;*.bmp")]
+        file_paths = filedialog.askopenfilenames(
+            title="Select Images",
+            filetypes=[("Image Files", "*.png;*.jpg;*.jpeg;*.bmp;*.tif;*.tiff;*.pdf"),
+                       ("Scanner Batches", "*.tif;*.tiff;*.pdf")]
         )
-        if file_path:
-            try:
-                pil_img = Image.open(file_path)
-                pil_img = fix_orientation(pil_img)
-                
-                # Optionally, resize the image if needed.
-                cv_img = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
-                resized = cv2.resize(cv_img, (800, 1000))
-                
-                # Call the main function to process the image.
-                processed_results = main.process_sections(resized)
-                # Update the content area with a success message.
-                for widget in content_frame.winfo_children():
-                    widget.destroy()
-                result_label = customtkinter.CTkLabel(
-                    master=content_frame,
-                    text="Image processed successfully! Go to the Results page to view output.",
-                    font=('Montserrat', 20),
-                    text_color=MAROON
-                )
-                result_label.place(relx=0.5, rely=0.5, anchor=tkinter.CENTER)
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to load/process image: {e}")
+        queue_files(file_paths)
+
+    # Files and folders dropped anywhere on the window go to the scan queue;
+    # folders are searched for images like batch.py does.
+    def on_drop(event):
+        dropped = dashboard.tk.splitlist(event.data)
+        file_paths = expand_paths(dropped)
+        if not file_paths:
+            messagebox.showinfo("Scan", "No images found in the dropped items.")
+            return event.action
+        queue_box = scan_widgets.get("queue")
+        if queue_box is None or not queue_box.winfo_exists():
+            show_content("Scan")
+        queue_files(file_paths)
+        return event.action
+
+    dashboard.drop_target_register(DND_FILES)
+    dashboard.dnd_bind("<<Drop>>", on_drop)
+
+    def cancel_scans():
+        scan_worker.cancel_all()
+
+    # Forget the jobs that are no longer queued or running.
+    def clear_finished():
+        for job_id in [job_id for job_id, job in scan_jobs.items() if job["finished"]]:
+            del scan_jobs[job_id]
+        queue_state["dirty"] = True
+        refresh_scan_status()
+
+    # Show the scan queue on the Scan page (if it is open): one line per
+    # item, a summary and the overall progress.
+    def refresh_scan_status():
+        queue_box = scan_widgets.get("queue")
+        if queue_box is None or not queue_box.winfo_exists() or not queue_state["dirty"]:
+            return
+        queue_state["dirty"] = False
+        lines = []
+        counts = {"Queued": 0, "Processing": 0, "Done": 0, "Failed": 0, "Cancelled": 0}
+        work_done = 0.0
+        for job in scan_jobs.values():
+            name = os.path.basename(job["path"])
+            lines.append(f"{name}: {job['status']}")
+            counts[job["status"].split(" ")[0]] += 1
+            work_done += 1.0 if job["finished"] else job["progress"]
+        queue_box.configure(state="normal")
+        queue_box.delete("0.0", "end")
+        queue_box.insert("0.0", "\n".join(lines) if lines else "No images queued.\n"
+                         "Drop files or folders here, or use Select Image.")
+        queue_box.configure(state="disabled")
+        scan_widgets["summary"].configure(
+            text=", ".join(f"{count} {state.lower()}" for state, count in counts.items() if count))
+        scan_widgets["progress"].set(work_done / len(scan_jobs) if scan_jobs else 0)
+
+    # Drain the worker's events; re-schedules itself with after().
+    def poll_worker():
+        for event in scan_worker.poll():
+            kind, job_id = event[0], event[1]
+            queue_state["dirty"] = True
+            if kind == "queued":
+                scan_jobs[job_id] = {"path": event[2], "status": "Queued", "progress": 0.0,
+                                     "finished": False}
+                continue
+            job = scan_jobs[job_id]
+            if kind == "started":
+                job["status"] = "Processing"
+            elif kind == "progress":
+                done, total, stage = event[2], event[3], event[4]
+                job["status"] = f"Processing ({stage})"
+                job["progress"] = done / total
+            elif kind == "done":
+                faculty, term = job_labels.pop(job_id, (None, None))
+                last_sheet["id"] = result_store.add_sheet(event[2], job["path"], faculty, term,
+                                                           FORM.id)
+                last_sheet["source"] = job_sources.pop(job_id, None)
+                last_sheet["results"] = event[2]
+                job["status"] = "Done - go to the Results page to view output"
+                job["finished"] = True
+            elif kind == "failed":
+                job_labels.pop(job_id, None)
+                job_sources.pop(job_id, None)
+                # Shown in the queue rather than in a dialog per failed sheet.
+                job["status"] = f"Failed - {event[2]}"
+                job["finished"] = True
+            elif kind == "cancelled":
+                job_labels.pop(job_id, None)
+                job_sources.pop(job_id, None)
+                job["status"] = "Cancelled"
+                job["finished"] = True
+        refresh_scan_status()
+        dashboard.after(100, poll_worker)
+
+    dashboard.after(100, poll_worker)
+
+    # Draw the detections of one section of the last sheet and show them in
+    # a window. Overlays are only rendered here, never while scoring.
+    def view_section(sec_name):
+        try:
+            path, page = last_sheet["source"]
+            img = load_scan(path) if page is None else load_page(path, page)
+            overlay = main.render_sections(img, last_sheet["results"], sections=[sec_name])[sec_name]
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to draw {sec_name}: {e}")
+            return
+        height, width = overlay.shape[:2]
+        pil_overlay = Image.fromarray(overlay[:, :, ::-1].copy())  # BGR -> RGB
+        window = customtkinter.CTkToplevel(dashboard)
+        window.title(sec_name)
+        overlay_label = customtkinter.CTkLabel(
+            master=window,
+            text="",
+            image=customtkinter.CTkImage(pil_overlay, size=(width * 2, height * 2))
+        )
+        overlay_label.pack(padx=10, pady=10)
 
     # Function to switch content.
     def show_content(name):
@@ -148,70 +272,129 @@ def open_dashboard(app):
         for widget in content_frame.winfo_children():
             widget.destroy()
         if name == "Scan":
-            # Show a "Select Image" button.
+            # Faculty and term the scanned sheets belong to.
+            labels_frame = customtkinter.CTkFrame(master=content_frame, fg_color=WHITE)
+            labels_frame.pack(fill="x", padx=20, pady=(20, 0))
+            faculty_entry = customtkinter.CTkEntry(
+                master=labels_frame,
+                placeholder_text="Faculty",
+                width=300,
+                font=('Montserrat', 14)
+            )
+            faculty_entry.pack(side="left", padx=(0, 10))
+            term_entry = customtkinter.CTkEntry(
+                master=labels_frame,
+                placeholder_text="Term (e.g. 2025-1)",
+                width=200,
+                font=('Montserrat', 14)
+            )
+            term_entry.pack(side="left")
+            if scan_labels["faculty"]:
+                faculty_entry.insert(0, scan_labels["faculty"])
+            if scan_labels["term"]:
+                term_entry.insert(0, scan_labels["term"])
+
+            # Show a "Select Image" button, the scan queue and a cancel button.
+            # Files and folders can also be dropped anywhere on the window.
             select_btn = customtkinter.CTkButton(
                 master=content_frame,
-                text="Select Image",
+                text="Select Image (or drop files and folders here)",
                 font=('Montserrat', 20),
                 fg_color=MAROON,
                 text_color=WHITE,
                 hover_color="#660000",
                 command=select_image
             )
-            select_btn.pack(expand=True, fill="both", padx=20, pady=20)
+            select_btn.pack(fill="x", padx=20, pady=20, ipady=20)
+
+            progress_bar = customtkinter.CTkProgressBar(master=content_frame, progress_color=MAROON)
+            progress_bar.pack(fill="x", padx=20)
+
+            summary_label = customtkinter.CTkLabel(
+                master=content_frame,
+                text="",
+                font=('Montserrat', 14),
+                text_color=MAROON,
+                anchor="w"
+            )
+            summary_label.pack(fill="x", padx=20, pady=(10, 0))
+
+            queue_box = customtkinter.CTkTextbox(
+                master=content_frame,
+                font=('Montserrat', 14),
+                text_color=MAROON,
+                fg_color=WHITE,
+                wrap="none"
+            )
+            queue_box.pack(expand=True, fill="both", padx=20, pady=10)
+
+            buttons_frame = customtkinter.CTkFrame(master=content_frame, fg_color=WHITE)
+            buttons_frame.pack(pady=(0, 20))
+            cancel_btn = customtkinter.CTkButton(
+                master=buttons_frame,
+                text="Cancel",
+                font=('Montserrat', 14),
+                fg_color=WHITE,
+                text_color=MAROON,
+                hover_color="#f0e68c",
+                command=cancel_scans
+            )
+            cancel_btn.pack(side="left", padx=10)
+            clear_btn = customtkinter.CTkButton(
+                master=buttons_frame,
+                text="Clear Finished",
+                font=('Montserrat', 14),
+                fg_color=WHITE,
+                text_color=MAROON,
+                hover_color="#f0e68c",
+                command=clear_finished
+            )
+            clear_btn.pack(side="left", padx=10)
+
+            scan_widgets["faculty"] = faculty_entry
+            scan_widgets["term"] = term_entry
+            scan_widgets["summary"] = summary_label
+            scan_widgets["queue"] = queue_box
+            scan_widgets["progress"] = progress_bar
+            queue_state["dirty"] = True
+            refresh_scan_status()
         elif name == "Results":
-            global processed_results
-            if processed_results is not None:
-                # Define your section titles and questions
-                section_titles = {
-                    "Section 1": "Commitment",
-                    "Section 2": "Knowledge of Subject",
-                    "Section 3": "Teaching for Independent Learning",
-                    "Section 4": "Management of Learning"
-                }
-                section_questions = {
-                    "Section 1": {
-                        1: "demonstrate sensitivity to students' ability to attend and absorb content information",
-                        2: "exhibit readiness and enthusiasm for professional development",
-                        3: "display consistency in teaching methodology",
-                        4: "adapt teaching to meet student needs",
-                        5: "engage students with diverse learning styles"
-                    },
-                    "Section 2": {
-                        1: "present subject matter with clarity",
-                        2: "use relevant examples and explanations",
-                        3: "integrate current research into teaching",
-                        4: "demonstrate mastery of core content",
-                        5: "address questions effectively"
-                    },
-                    "Section 3": {
-                        1: "encourage independent inquiry",
-                        2: "provide effective feedback",
-                        3: "support collaborative learning",
-                        4: "promote critical thinking",
-                        5: "use technology to enhance learning"
-                    },
-                    "Section 4": {
-                        1: "organize classroom effectively",
-                        2: "manage time efficiently",
-                        3: "set clear learning objectives",
-                        4: "maintain a positive classroom climate",
-                        5: "evaluate student progress fairly"
-                    }
-                }
-                
+            sheet = None
+            if last_sheet["id"] is not None:
+                sheet = result_store.load_sheet(last_sheet["id"])
+            if sheet is not None:
+                info, sheet_results = sheet
                 # Build a display string for the results.
                 display_text = ""
-                for sec, data in processed_results.items():
-                    title = section_titles.get(sec, sec)
+                if info["faculty"] or info["term"]:
+                    display_text += f"Faculty: {info['faculty'] or '-'}    Term: {info['term'] or '-'}\n\n"
+                for sec, data in sheet_results.items():
+                    title = SECTION_TITLES.get(sec, sec)
                     display_text += f"{title}:\n"
                     # Assume your process_sections function stores row scores in data['row_scores']
                     row_scores = data.get("row_scores", {})
                     for row in sorted(row_scores.keys()):
-                        question_text = section_questions.get(sec, {}).get(row, f"Row {row}")
+                        question_text = SECTION_QUESTIONS.get(sec, {}).get(row, f"Row {row}")
                         display_text += f"{row}. {question_text}: {row_scores[row]}\n"
                     display_text += f"Total Score: {data.get('total_score', 'N/A')}\n\n"
                 
+                # One "View" button per section when the overlays can be drawn
+                # (sheets scanned in this session).
+                if last_sheet["results"] is not None and last_sheet["source"] is not None:
+                    view_frame = customtkinter.CTkFrame(master=content_frame, fg_color=WHITE)
+                    view_frame.pack(fill="x", padx=20, pady=(20, 0))
+                    for sec in last_sheet["results"]:
+                        view_btn = customtkinter.CTkButton(
+                            master=view_frame,
+                            text=f"View {sec}",
+                            font=('Montserrat', 14),
+                            fg_color=MAROON,
+                            text_color=WHITE,
+                            hover_color="#660000",
+                            command=lambda sec=sec: view_section(sec)
+                        )
+                        view_btn.pack(side="left", padx=(0, 10))
+                
                 results_textbox = customtkinter.CTkTextbox(
                     master=content_frame,
                     font=('Montserrat', 24),
@@ -229,6 +412,82 @@ def open_dashboard(app):
                     text_color=MAROON
                 )
                 no_result_label.place(relx=0.5, rely=0.5, anchor=tkinter.CENTER)
+        elif name == "Print":
+            # Per-faculty summary of every stored sheet (see analytics.py),
+            # optionally narrowed down to one faculty member and/or term.
+            filters_frame = customtkinter.CTkFrame(master=content_frame, fg_color=WHITE)
+            filters_frame.pack(fill="x", padx=20, pady=(20, 0))
+            faculty_entry = customtkinter.CTkEntry(
+                master=filters_frame,
+                placeholder_text="Faculty (all)",
+                width=300,
+                font=('Montserrat', 14)
+            )
+            faculty_entry.pack(side="left", padx=(0, 10))
+            term_entry = customtkinter.CTkEntry(
+                master=filters_frame,
+                placeholder_text="Term (all)",
+                width=200,
+                font=('Montserrat', 14)
+            )
+            term_entry.pack(side="left", padx=(0, 10))
+
+            report_box = customtkinter.CTkTextbox(
+                master=content_frame,
+                font=('Montserrat', 14),
+                text_color=MAROON,
+                fg_color=WHITE,
+                wrap="word"
+            )
+            report_box.pack(expand=True, fill="both", padx=20, pady=20)
+
+            # Summaries per form (see analytics.build_report).
+            report = {"forms": []}
+
+            def refresh_report():
+                faculty = faculty_entry.get().strip() or None
+                term = term_entry.get().strip() or None
+                report["forms"] = analytics.build_report(result_store, faculty, term)
+                report_box.delete("0.0", "end")
+                if report["forms"]:
+                    report_box.insert("0.0", analytics.format_summary(report["forms"]))
+                else:
+                    report_box.insert("0.0", "No scored sheets found.")
+
+            def export_report(kind):
+                if not report["forms"]:
+                    messagebox.showinfo("Export", "There is nothing to export yet.")
+                    return
+                path = filedialog.asksaveasfilename(
+                    title="Save Report",
+                    defaultextension=f".{kind}",
+                    filetypes=[("CSV files", "*.csv")] if kind == "csv"
+                    else [("HTML files", "*.html")]
+                )
+                if not path:
+                    return
+                if kind == "csv":
+                    analytics.export_csv(report["forms"], path)
+                else:
+                    analytics.export_html(report["forms"], path)
+                    # Print from the browser (one page per faculty member).
+                    webbrowser.open(Path(path).resolve().as_uri())
+
+            for text, command in (("Refresh", refresh_report),
+                                  ("Export CSV", lambda: export_report("csv")),
+                                  ("Print Report", lambda: export_report("html"))):
+                btn = customtkinter.CTkButton(
+                    master=filters_frame,
+                    text=text,
+                    font=('Montserrat', 14),
+                    fg_color=MAROON,
+                    text_color=WHITE,
+                    hover_color="#660000",
+                    command=command
+                )
+                btn.pack(side="left", padx=5)
+
+            refresh_report()
         else:
             content_label = customtkinter.CTkLabel(
                 master=content_frame,
@@ -259,6 +518,8 @@ def open_dashboard(app):
     def confirm_logout():
         response = messagebox.askyesno("Confirm Logout", "Are you sure you want to logout?")
         if response:
+            scan_worker.stop()
+            result_store.close()
             dashboard.destroy()
 
     logout_btn = customtkinter.CTkButton(
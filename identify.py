@@ -0,0 +1,144 @@
+import sys
+import time
+import argparse
+
+import cv2
+import numpy as np
+from align import find_table_corners
+from loader import load_scan
+from template import available_forms, get_template
+
+# Width the sheet is shrunk to before it is warped onto a form's frame and
+# hashed; small enough that the whole check costs a few milliseconds.
+SIGNATURE_WIDTH = 200
+
+# dHash grid of a signature: (columns, rows) of left/right brightness
+# comparisons, i.e. 128 bits.
+HASH_SIZE = (16, 8)
+
+# A sheet is printed on a form when at most this many signature bits
+# differ. Rescans of the TER form (other resolutions, turned by up to 5
+# degrees) differ by up to 20 bits; other pages, blank or upside-down ones
+# by 46 or more.
+MAX_DISTANCE = 32
+
+
+def dhash(gray, size=HASH_SIZE):
+    """
+    Difference hash of a grayscale image: shrink it to (columns + 1) x rows
+    and keep, for every pixel, whether it is brighter than its left
+    neighbour. Returns the bits as a hex string.
+    """
+    small = cv2.resize(gray, (size[0] + 1, size[1]), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return np.packbits(bits).tobytes().hex()
+
+
+def hamming(a, b):
+    """Number of bits that differ between two hex hashes."""
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+def shrink(img):
+    """Grayscale copy of img, SIGNATURE_WIDTH wide; returns it and the scale."""
+    scale = SIGNATURE_WIDTH / img.shape[1]
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    return cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA), scale
+
+
+def page_signature(small, scale, corners, form):
+    """
+    Signature of a sheet as if it were printed on form: warp the shrunk
+    sheet onto the form's frame (by its table corners, like
+    align.align_page) and hash the form's signature box.
+
+    Input:
+      small, scale: the output of shrink.
+      corners: table corners from align.find_table_corners, in the
+               coordinates of the full-size sheet (None: just resize).
+      form: a template.FormTemplate with a signature_box.
+    """
+    q = SIGNATURE_WIDTH / form.page_size[0]
+    size = (SIGNATURE_WIDTH, int(round(form.page_size[1] * q)))
+    if corners is None:
+        page = cv2.resize(small, size, interpolation=cv2.INTER_AREA)
+    else:
+        matrix = cv2.getPerspectiveTransform(corners * scale, form.table_corners * q)
+        page = cv2.warpPerspective(small, matrix, size, flags=cv2.INTER_LINEAR,
+                                   borderMode=cv2.BORDER_REPLICATE)
+    y0, y1, x0, x1 = [int(round(v * q)) for v in form.signature_box]
+    return dhash(page[y0:y1, x0:x1])
+
+
+def identify_form(img, forms=None):
+    """
+    Find the form a sheet is printed on by comparing its signature with the
+    one of every known form.
+
+    Input:
+      img: the scanned sheet (BGR), as loaded by load_scan.
+      forms: the templates to choose from (default: every form in forms/).
+             Forms without a signature can not be recognized.
+
+    Returns:
+      (form, distance, corners): the matching template, or None when no
+      form is within MAX_DISTANCE bits; distance is the number of bits that
+      differ from the closest form (None if no form has a signature);
+      corners are the table corners found on the way
+      (align.find_table_corners), for align.align_page to reuse.
+    """
+    if forms is None:
+        forms = [get_template(form_id) for form_id in available_forms()]
+    corners = find_table_corners(img)
+    small, scale = shrink(img)
+
+    best = None
+    best_distance = None
+    for form in forms:
+        if form.signature is None:
+            continue
+        distance = hamming(page_signature(small, scale, corners, form), form.signature)
+        if best_distance is None or distance < best_distance:
+            best, best_distance = form, distance
+    if best_distance is None or best_distance > MAX_DISTANCE:
+        return None, best_distance, corners
+    return best, best_distance, corners
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Tell which form revision each scan is printed on.")
+    parser.add_argument("paths", nargs="+", help="scanned sheets")
+    parser.add_argument("-s", "--signature", metavar="FORM",
+                        help="print the signature of each scan in FORM's signature box "
+                             "instead (for the form's definition file)")
+    args = parser.parse_args(argv)
+
+    if args.signature:
+        try:
+            form = get_template(args.signature)
+        except KeyError as e:
+            print(e.args[0], file=sys.stderr)
+            return 1
+        for path in args.paths:
+            img = load_scan(path)
+            small, scale = shrink(img)
+            print(f"{path}: {page_signature(small, scale, find_table_corners(img), form)}")
+        return 0
+
+    unknown = 0
+    for path in args.paths:
+        img = load_scan(path)
+        start = time.perf_counter()
+        form, distance, _ = identify_form(img)
+        ms = (time.perf_counter() - start) * 1000.0
+        if form is None:
+            unknown += 1
+            print(f"{path}: not recognized (closest distance {distance}, {ms:.1f} ms)")
+        else:
+            print(f"{path}: {form.id} (distance {distance}, {ms:.1f} ms)")
+    return 1 if unknown else 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,226 @@
+import os
+import sys
+import json
+import time
+import threading
+import functools
+import contextlib
+import contextvars
+
+import numpy as np
+
+# Set to a file path to trace every scan of the dashboard to a JSON-lines
+# file (see install_from_env).
+TRACE_ENV = "TER_TRACE"
+
+# Active sinks. Instrumentation is disabled (and close to free) while empty.
+_sinks = []
+_sinks_lock = threading.Lock()
+
+# Sheet the records of the current thread/task belong to (see sheet()).
+_current_sheet = contextvars.ContextVar("ter_sheet", default=None)
+
+
+def enabled():
+    return bool(_sinks)
+
+
+def add_sink(sink):
+    with _sinks_lock:
+        _sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    with _sinks_lock:
+        if sink in _sinks:
+            _sinks.remove(sink)
+
+
+def _emit(record):
+    record["sheet"] = _current_sheet.get()
+    for sink in list(_sinks):
+        sink.write(record)
+
+
+class _NullTimer:
+    """Shared do-nothing context manager returned while disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    def __init__(self, stage, tags):
+        self.stage = stage
+        self.tags = tags
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        ms = (time.perf_counter() - self.start) * 1000.0
+        _emit({"type": "timer", "name": self.stage, "ms": ms, **self.tags})
+        return False
+
+
+def timer(stage, **tags):
+    """
+    Context manager timing a block of code as `stage`:
+
+        with instrument.timer("align"):
+            ...
+
+    Extra keyword arguments (e.g. section="Section 1") are stored with the
+    record.
+    """
+    if not _sinks:
+        return _NULL_TIMER
+    return _Timer(stage, tags)
+
+
+def timed(stage, tags=()):
+    """
+    Decorator timing every call of a function as `stage`. `tags` names
+    keyword arguments of the call to store with the record, e.g.
+    tags=("section_name",).
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _sinks:
+                return func(*args, **kwargs)
+            with _Timer(stage, {name: kwargs[name] for name in tags if name in kwargs}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, value=1, **tags):
+    """Record a counter, e.g. count("circles_found", 5, section="Section 2")."""
+    if _sinks:
+        _emit({"type": "count", "name": name, "value": value, **tags})
+
+
+def event(name, **fields):
+    """Record something that happened, with any JSON-friendly fields."""
+    if _sinks:
+        _emit({"type": "event", "name": name, **fields})
+
+
+@contextlib.contextmanager
+def sheet(name):
+    """Tag every record made inside the block with the sheet `name`."""
+    token = _current_sheet.set(name)
+    try:
+        yield
+    finally:
+        _current_sheet.reset(token)
+
+
+def bind(func):
+    """
+    Return func bound to a copy of the current context, so work handed to a
+    thread pool keeps the sheet tag of the code that submitted it.
+    """
+    if not _sinks:
+        return func
+    return functools.partial(contextvars.copy_context().run, func)
+
+
+class JsonLinesSink:
+    """
+    Append every record as one JSON line to a file. The file is line
+    buffered, so several processes can share it without mixing up lines.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "a", encoding="utf-8", buffering=1)
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps({"ts": time.time(), "pid": os.getpid(), **record}, default=str)
+        with self.lock:
+            self.file.write(line + "\n")
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class HistogramSink:
+    """
+    Keep every timing and counter in memory: per-stage latency percentiles,
+    counter totals and the slowest sheets.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = {}   # stage -> list of (ms, sheet)
+        self.counters = {}  # counter -> total
+
+    def write(self, record):
+        with self.lock:
+            if record["type"] == "timer":
+                self.timings.setdefault(record["name"], []).append((record["ms"], record["sheet"]))
+            elif record["type"] == "count":
+                self.counters[record["name"]] = self.counters.get(record["name"], 0) + record["value"]
+
+    def summary(self):
+        """stage -> {"count", "p50", "p90", "p99", "max"} in milliseconds."""
+        with self.lock:
+            timings = {stage: [ms for ms, _ in samples] for stage, samples in self.timings.items()}
+        stats = {}
+        for stage, values in timings.items():
+            p50, p90, p99 = np.percentile(values, [50, 90, 99])
+            stats[stage] = {"count": len(values), "p50": float(p50), "p90": float(p90),
+                            "p99": float(p99), "max": float(max(values))}
+        return stats
+
+    def slowest(self, stage="process_sections", n=5):
+        """The n slowest (ms, sheet) samples of a stage, slowest first."""
+        with self.lock:
+            samples = list(self.timings.get(stage, []))
+        return sorted(samples, key=lambda sample: sample[0], reverse=True)[:n]
+
+    def format(self):
+        lines = [f"{'stage':<26}{'count':>7}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+        for stage, s in self.summary().items():
+            lines.append(f"{stage:<26}{s['count']:>7}{s['p50']:>10.2f}{s['p90']:>10.2f}"
+                         f"{s['p99']:>10.2f}{s['max']:>10.2f}")
+        for name, total in sorted(self.counters.items()):
+            lines.append(f"{name}: {total}")
+        return "\n".join(lines)
+
+
+class ConsoleSink:
+    """Print counters and events (not timings) as they happen; for -v output."""
+
+    def __init__(self, stream=None):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        if record["type"] == "timer":
+            return
+        fields = " ".join(f"{key}={value}" for key, value in record.items()
+                          if key not in ("type", "name", "sheet") and value is not None)
+        prefix = f"{record['sheet']}: " if record["sheet"] else ""
+        with self.lock:
+            print(f"{prefix}{record['name']} {fields}", file=self.stream or sys.stdout)
+
+
+def install_from_env():
+    """Add a JsonLinesSink when the TER_TRACE environment variable is set."""
+    path = os.environ.get(TRACE_ENV)
+    if not path:
+        return None
+    return add_sink(JsonLinesSink(path))
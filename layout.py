@@ -0,0 +1,148 @@
+import sys
+import json
+import argparse
+import threading
+
+# A cached grid line still counts as present when this fraction of the
+# section (its width for rows, its height for columns) is ink along it.
+MIN_LINE_COVERAGE = 0.5
+
+# How many pixels a printed rule may have moved since the grid was cached.
+LINE_TOLERANCE = 2
+
+
+def is_confident(y_coords, x_coords, expected_rows, expected_columns):
+    """
+    A detection is good enough to cache when it found exactly the lines the
+    printed form has: one more line than there are rows and columns.
+    """
+    return len(y_coords) == expected_rows + 1 and len(x_coords) == expected_columns + 1
+
+
+def line_coverage(binary, coords, axis, tolerance=LINE_TOLERANCE):
+    """
+    For every coordinate in coords, the fraction of positions along the line
+    that have ink within +/- tolerance pixels of it (so a rule that runs a
+    pixel or two askew across the section still counts in full).
+    axis=0 checks horizontal lines (coords are y values), axis=1 vertical
+    lines (coords are x values).
+    """
+    if axis == 1:
+        binary = binary.T
+    coverage = []
+    for c in coords:
+        band = binary[max(0, c - tolerance):c + tolerance + 1]
+        if band.size == 0:
+            coverage.append(0.0)
+        else:
+            coverage.append(float((band > 0).any(axis=0).mean()))
+    return coverage
+
+
+def verify_grid(planes, grid, min_coverage=MIN_LINE_COVERAGE):
+    """
+    Cheap check that a cached grid still matches the section: every cached
+    row and column line must have ink under it in the section's binary
+    planes (from utils.preprocess/crop_planes), between the first and last
+    line across it (the rules end there; the section box goes beyond).
+    """
+    y_coords, x_coords = grid
+    if not y_coords or not x_coords:
+        return False
+    rows = planes["binary_blurred"][:, min(x_coords):max(x_coords) + 1]
+    columns = planes["binary"][min(y_coords):max(y_coords) + 1]
+    rows_ok = min(line_coverage(rows, y_coords, axis=0), default=0.0)
+    cols_ok = min(line_coverage(columns, x_coords, axis=1), default=0.0)
+    return rows_ok >= min_coverage and cols_ok >= min_coverage
+
+
+class LayoutCache:
+    """
+    Row/column grids of the form sections, keyed by form template and
+    section name, so later sheets of the same form can skip line detection.
+
+    process_sections fills the cache from confident detections and drops a
+    section's grid as soon as it fails verify_grid on a new sheet. A cache
+    can be saved to (and loaded from) a JSON file, e.g. after a calibration
+    run on a known good scan.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._grids = {}  # (template, section) -> (y_coords, x_coords)
+        self._lock = threading.Lock()
+        if path is not None:
+            self.load(path)
+
+    def get(self, template, sec_name):
+        with self._lock:
+            return self._grids.get((template, sec_name))
+
+    def sections(self, template):
+        """Names of the sections of a template that have a cached grid."""
+        with self._lock:
+            return sorted(sec_name for (t, sec_name) in self._grids if t == template)
+
+    def put(self, template, sec_name, y_coords, x_coords):
+        grid = ([int(y) for y in y_coords], [int(x) for x in x_coords])
+        with self._lock:
+            self._grids[(template, sec_name)] = grid
+
+    def invalidate(self, template, sec_name=None):
+        """Forget one section of a template, or the whole template."""
+        with self._lock:
+            for key in list(self._grids):
+                if key[0] == template and (sec_name is None or key[1] == sec_name):
+                    del self._grids[key]
+
+    def load(self, path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            for template, sections in data.items():
+                for sec_name, grid in sections.items():
+                    self._grids[(template, sec_name)] = (grid["y"], grid["x"])
+
+    def save(self, path=None):
+        data = {}
+        with self._lock:
+            for (template, sec_name), (y_coords, x_coords) in sorted(self._grids.items()):
+                data.setdefault(template, {})[sec_name] = {"y": y_coords, "x": x_coords}
+        with open(path or self.path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+
+
+def calibrate(paths, output):
+    """
+    Detect the grid on known good scans and store every confidently
+    detected section in a layout file for batch runs to start from. The
+    grids are found section by section (table=False), the way the runs
+    that use the file read the sheets.
+    """
+    import main  # imported here: main imports this module
+    from loader import load_scan
+
+    cache = LayoutCache()
+    for path in paths:
+        main.process_sections(load_scan(path), layout_cache=cache, table=False)
+    cache.save(output)
+    return cache
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Calibrate the section grid layout from known good scans."
+    )
+    parser.add_argument("paths", nargs="+", help="scans of the form to calibrate from")
+    parser.add_argument("-o", "--output", default="layout.json",
+                        help="layout file to write (default: layout.json)")
+    args = parser.parse_args()
+
+    from template import get_template
+    cache = calibrate(args.paths, args.output)
+    sections = cache.sections(get_template().id)
+    print(f"Saved grids for {len(sections)} section(s) to {args.output}: {', '.join(sections)}")
+    sys.exit(0 if sections else 1)
@@ -0,0 +1,179 @@
+import cv2
+import numpy as np
+from PIL import Image, ExifTags, ImageSequence
+from template import get_template
+
+# Every scan is brought to the page_size of the default form (template.py)
+# unless a size is asked for; process_sections brings it into the frame of
+# the sheet's own form.
+
+# The JPEG decoder may only shrink a scan down to this many times the target
+# size. Decoding closer to the target (e.g. a 3024x4032 photo straight to
+# 756x1008) blurs the thin table rules enough for the line detectors to miss
+# or invent grid lines (a 6-column Section 1 on scan2.jpg).
+DRAFT_FACTOR = 2
+
+# Containers an ADF scanner writes a whole stack of sheets to, one per page.
+MULTI_PAGE_EXTENSIONS = (".tif", ".tiff", ".pdf")
+
+# EXIF orientation tag id (274), looked up once instead of per image.
+ORIENTATION_TAG = next(tag for tag, name in ExifTags.TAGS.items() if name == 'Orientation')
+
+
+def get_orientation(pil_img):
+    """Return the EXIF orientation of the image, or None if it has none."""
+    try:
+        exif = pil_img._getexif()
+    except Exception:
+        return None
+    if exif is None:
+        return None
+    return exif.get(ORIENTATION_TAG, None)
+
+
+def fix_orientation(pil_img):
+    try:
+        orientation = get_orientation(pil_img)
+        if orientation == 3:
+            pil_img = pil_img.rotate(180, expand=True)
+        elif orientation == 6:
+            pil_img = pil_img.rotate(270, expand=True)
+        elif orientation == 8:
+            pil_img = pil_img.rotate(90, expand=True)
+    except Exception as e:
+        print("Error fixing orientation:", e)
+    return pil_img
+
+
+def page_size(size=None):
+    """size, or the page_size of the default form when None."""
+    return get_template().page_size if size is None else size
+
+
+def decode_scan(path, size=None):
+    """
+    Decode a scanned sheet to roughly `size` (width, height), upright.
+
+    JPEGs are decoded straight to a reduced resolution with PIL's draft()
+    (DCT-domain downscaling) of at least DRAFT_FACTOR times `size`, so very
+    large photos never exist in memory at full size. The EXIF orientation
+    is then applied to the smaller image.
+
+    Returns:
+      the image as a BGR NumPy array, at least DRAFT_FACTOR times `size`
+      when the file is that large.
+    """
+    width, height = page_size(size)
+    with Image.open(path) as pil_img:
+        # Orientations 6 and 8 are stored sideways, so the decoder has to
+        # aim for the target size with width and height swapped.
+        if get_orientation(pil_img) in (6, 8):
+            width, height = height, width
+        pil_img.draft("RGB", (width * DRAFT_FACTOR, height * DRAFT_FACTOR))
+
+        pil_img = fix_orientation(pil_img)
+        return cv2.cvtColor(np.asarray(pil_img.convert("RGB")), cv2.COLOR_RGB2BGR)
+
+
+def load_scan(path, size=None):
+    """
+    Load a scanned sheet as a BGR image of exactly `size` (width, height):
+    decode_scan followed by a single cv2.resize. INTER_AREA averages the
+    pixels it drops, so the one-pixel table rules survive the 2-4x shrink
+    (INTER_LINEAR samples between them and breaks them up).
+
+    Input:
+      path: path of the image file.
+      size: (width, height) of the returned image (default: page_size()).
+
+    Returns:
+      the image as a BGR NumPy array of shape (height, width, 3).
+    """
+    size = page_size(size)
+    return cv2.resize(decode_scan(path, size), size, interpolation=cv2.INTER_AREA)
+
+
+def is_multi_page(path):
+    """True for the container formats read page by page (MULTI_PAGE_EXTENSIONS)."""
+    return path.lower().endswith(MULTI_PAGE_EXTENSIONS)
+
+
+def page_name(path, index):
+    """Name a page of a container is scored and stored under, e.g. 'stack.pdf#page3'."""
+    return f"{path}#page{index + 1}"
+
+
+def count_pages(path):
+    """Number of pages in a TIFF or PDF container."""
+    if path.lower().endswith(".pdf"):
+        with _open_pdf(path) as doc:
+            return doc.page_count
+    with Image.open(path) as pil_img:
+        return getattr(pil_img, "n_frames", 1)
+
+
+def iter_pages(path, size=None):
+    """
+    Yield every page of a multi-page TIFF or PDF as (name, image), straight
+    from the container: pages are decoded one at a time, as they are asked
+    for, and never written to disk.
+
+    Input:
+      path: path of the .tif/.tiff/.pdf file.
+      size: (width, height) of the returned images (default: page_size()).
+
+    Yields:
+      (page_name(path, index), BGR image of shape (height, width, 3)).
+    """
+    size = page_size(size)
+    if path.lower().endswith(".pdf"):
+        with _open_pdf(path) as doc:
+            for index, page in enumerate(doc):
+                yield page_name(path, index), _render_pdf_page(page, size)
+        return
+
+    with Image.open(path) as pil_img:
+        for index, frame in enumerate(ImageSequence.Iterator(pil_img)):
+            yield page_name(path, index), _frame_to_bgr(frame, size)
+
+
+def load_page(path, index, size=None):
+    """Load a single page (0-based index) of a multi-page TIFF or PDF."""
+    size = page_size(size)
+    if path.lower().endswith(".pdf"):
+        with _open_pdf(path) as doc:
+            return _render_pdf_page(doc.load_page(index), size)
+
+    with Image.open(path) as pil_img:
+        pil_img.seek(index)
+        return _frame_to_bgr(pil_img, size)
+
+
+def _frame_to_bgr(frame, size):
+    # Scanner TIFFs are often bilevel or grayscale at 300 dpi; INTER_AREA
+    # keeps the thin grid lines when shrinking them.
+    rgb = np.asarray(frame.convert("RGB"))
+    return cv2.resize(cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR), size, interpolation=cv2.INTER_AREA)
+
+
+def _open_pdf(path):
+    # PyMuPDF is only needed for PDF scans, so it is imported on first use.
+    try:
+        import pymupdf
+    except ImportError:
+        raise ImportError("Reading PDF scans needs PyMuPDF: pip install pymupdf")
+    return pymupdf.open(path)
+
+
+def _render_pdf_page(page, size):
+    import pymupdf
+
+    # Render straight at the target size instead of at the page's full
+    # resolution.
+    matrix = pymupdf.Matrix(size[0] / page.rect.width, size[1] / page.rect.height)
+    pix = page.get_pixmap(matrix=matrix, colorspace=pymupdf.csRGB, alpha=False)
+    rgb = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+    img = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+    if img.shape[1] != size[0] or img.shape[0] != size[1]:
+        img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+    return img
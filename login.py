@@ -1,9 +1,25 @@
+import time
+START = time.perf_counter()  # before any other import, for the startup budget
+
 import os
 import sys
+import threading
+import importlib
+import traceback
 import tkinter
+from tkinter import messagebox
 import customtkinter
 from PIL import Image
-from dashboard import open_dashboard  # 👈 Import from the other file
+
+# The dashboard (and with it OpenCV, NumPy and the scoring pipeline) is
+# imported on a background thread once the login window is up, not before.
+DASHBOARD_MODULE = "dashboard"
+
+# The login window should be painted within this many milliseconds of the
+# process starting. Run with TER_STARTUP_CHECK=1 to measure it: the app
+# prints the timings and exits (status 1 when over budget).
+STARTUP_BUDGET_MS = 1000
+STARTUP_CHECK_ENV = "TER_STARTUP_CHECK"
 
 # Helper function to get absolute path to a resource.
 def resource_path(relative_path):
@@ -28,6 +44,65 @@ WHITE = "#FFFFFF"
 
 app.configure(bg=MAROON)
 
+# Background import of the dashboard, started after the first paint.
+warmup = {"thread": None, "module": None, "error": None, "ms": None}
+
+def warm_up():
+    start = time.perf_counter()
+    try:
+        warmup["module"] = importlib.import_module(DASHBOARD_MODULE)
+    except Exception as e:
+        warmup["error"] = e
+    warmup["ms"] = (time.perf_counter() - start) * 1000.0
+
+def start_warmup():
+    if warmup["thread"] is None:
+        warmup["thread"] = threading.Thread(target=warm_up, daemon=True)
+        warmup["thread"].start()
+
+def login():
+    # Wait (without freezing the window) for the warm-up to finish.
+    start_warmup()
+    if warmup["thread"].is_alive():
+        button1.configure(text="Loading...", state="disabled")
+        app.after(50, login)
+        return
+    if warmup["error"] is not None:
+        # Report the failed import (raising here would only reach Tk's
+        # callback handler and leave the button on "Loading...") and let
+        # the next click try again.
+        error = warmup["error"]
+        traceback.print_exception(type(error), error, error.__traceback__)
+        warmup["thread"] = None
+        warmup["error"] = None
+        button1.configure(text="Login", state="normal")
+        messagebox.showerror("Error", f"Failed to load the dashboard: {error}")
+        return
+    warmup["module"].open_dashboard(app)
+
+def first_paint():
+    # Everything up to here is what the user waits for before seeing a window.
+    app.update_idletasks()
+    paint_ms = (time.perf_counter() - START) * 1000.0
+    heavy = [name for name in ("cv2", "numpy", "main") if name in sys.modules]
+    start_warmup()
+    if not os.environ.get(STARTUP_CHECK_ENV):
+        return
+
+    def report():
+        if warmup["thread"].is_alive():
+            app.after(50, report)
+            return
+        print(f"login window painted after {paint_ms:.0f} ms "
+              f"(budget {STARTUP_BUDGET_MS} ms)")
+        print(f"dashboard warm-up took {warmup['ms']:.0f} ms in the background")
+        if heavy:
+            print(f"imported before the window appeared: {', '.join(heavy)}")
+        app.destroy()
+        sys.exit(1 if paint_ms > STARTUP_BUDGET_MS or heavy else 0)
+
+    report()
+
 # Improved Login Frame UI
 frame = customtkinter.CTkFrame(master=app, width=360, height=420, corner_radius=20, fg_color=WHITE)
 frame.place(relx=0.5, rely=0.5, anchor=tkinter.CENTER)
@@ -64,7 +139,7 @@ button1 = customtkinter.CTkButton(
     width=260,
     height=40,
     text="Login",
-    command=lambda: open_dashboard(app),
+    command=login,
     font=('Montserrat', 14),
     corner_radius=8,
     fg_color=MAROON,
@@ -73,4 +148,5 @@ button1 = customtkinter.CTkButton(
 )
 button1.place(relx=0.5, y=290, anchor=tkinter.CENTER)
 
+app.after(0, first_paint)
 app.mainloop()
@@ -5,8 +5,8 @@ a = Analysis(
     ['login.py'],
     pathex=[],
     binaries=[],
-    datas=[('assets', 'assets')],
-    hiddenimports=['tkinterdnd2'],
+    datas=[('assets', 'assets'), ('profiles.json', '.'), ('forms', 'forms')],
+    hiddenimports=['tkinterdnd2', 'dashboard'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -16,12 +16,14 @@ a = Analysis(
 )
 pyz = PYZ(a.pure)
 
+# One-folder build: OpenCV, NumPy and the other binaries are unpacked once
+# at install time (dist/login/) instead of into a temp folder on every
+# launch, as a one-file EXE does.
 exe = EXE(
     pyz,
     a.scripts,
-    a.binaries,
-    a.datas,
     [],
+    exclude_binaries=True,
     name='login',
     debug=False,
     bootloader_ignore_signals=False,
@@ -36,3 +38,14 @@ exe = EXE(
     codesign_identity=None,
     entitlements_file=None,
 )
+# No UPX on the collected binaries: a compressed OpenCV DLL is unpacked
+# again in memory on every launch.
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.datas,
+    strip=False,
+    upx=False,
+    upx_exclude=[],
+    name='login',
+)
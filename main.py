@@ -1,8 +1,246 @@
 import cv2
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 import utils  # Make sure your utils file defines detect_horizontal_lines, detect_vertical_lines, detect_circles
+import layout
+from align import align_page
+import scoring
+import instrument
+from profiles import DEFAULT_PARAMS
+from template import get_template
 
-def process_sections(img):
+# Section boxes, question texts, rating scale and so on come from the form
+# template (template.py, forms/*.json); process_sections uses the default
+# form unless it is given another one.
+
+# Grid finders a section can use (see grid_method).
+GRID_METHODS = ("hough", "projection")
+
+# Pixels kept around the outer rules of a section found in table mode.
+TABLE_MARGIN = 5
+
+def score_section(sec_name, y_coords, x_coords, circles, output_c, confidence=None,
+                  template=None):
+    """
+    Turn the detections of one section into scores: assign every circle to
+    the cell (row, column) it falls in (scoring.assign_cells) and score it
+    by its column (template.column_score; default form when None). Circles
+    outside the grid are counted as "cells_unassigned" and the scores are
+    reported as a "section_scored" event (instrument.py).
+    
+    A grid that does not have the form's rows and columns is not scored at
+    all: a missed or phantom rule shifts every answer after it, so the
+    section gets an "error" entry and no scores (counted as "grid_rejected").
+    
+    Returns the result dict stored under the section name by process_sections
+    (with a "confidence" entry when the fill-ratio scorer supplied one).
+    """
+    # Bin every circle into its (row, column) cell in one go; only one
+    # circle per cell is kept.
+    cells, unassigned, answers = scoring.assign_cells(circles, y_coords, x_coords)
+    instrument.count("cells_unassigned", len(unassigned), section=sec_name)
+    unique_cells = {(row, col): (x, y, r) for (row, col, x, y, r) in cells}
+    
+    # Compute total score for the section.
+    # The form's scale decides the score of every column (5..1 on the TER form).
+    form = template or get_template()
+    total_columns = answers.shape[1]  # e.g., if there are 6 vertical lines then there are 5 columns.
+    section_total_score = 0
+    
+    # Only a grid of the form's shape can be scored.
+    expected_rows = form.sections[sec_name].expected_rows
+    error = None
+    if answers.shape != (expected_rows, form.columns):
+        error = (f"{sec_name}: found a grid of {answers.shape[0]} rows x {total_columns} "
+                 f"columns, expected {expected_rows} x {form.columns}")
+        instrument.count("grid_rejected", section=sec_name)
+        cells = []
+    
+    # Prepare a mapping of row number to score.
+    row_scores = {}
+    for (row, col, x, y, r) in cells:
+        score = form.column_score(col)
+        section_total_score += score
+        # If a row has multiple cells, you might decide to sum them or choose one.
+        # Here we assume one circle per row; if multiple, later ones overwrite.
+        row_scores[row] = score
+    
+    instrument.event("section_scored", section=sec_name, total_score=int(section_total_score),
+                     row_scores={int(row): int(score) for row, score in sorted(row_scores.items())},
+                     unassigned=unassigned or None)
+    
+    # Store results for the section.
+    result = {
+        "unique_cells": unique_cells,
+        "row_scores": row_scores,
+        "total_score": section_total_score,
+        "total_columns": total_columns,
+        "answers": answers,  # (rows x columns) matrix, 1 where a circle was found.
+        "y_coords": [int(y) for y in y_coords],  # Grid the answers were read from.
+        "x_coords": [int(x) for x in x_coords],
+        "output": output_c  # Section image with circles drawn, None unless draw=True.
+    }
+    if confidence is not None and error is None:
+        result["confidence"] = confidence
+    if error is not None:
+        result["error"] = error
+    return result
+
+def section_errors(results):
+    """
+    Messages of the sections of a sheet that could not be scored (see
+    score_section), from process_sections or plain_results. A sheet with
+    any of these should be rescanned or checked by hand, not stored.
+    """
+    return [data["error"] for data in results.values() if "error" in data]
+
+def plain_results(results):
+    """
+    The results of process_sections without the images, as plain ints and
+    lists (JSON serializable, cheap to pickle): section name -> dict with
+    "row_scores", "total_score", "total_columns", "answers", "y_coords",
+    "x_coords", from the fill scorer "confidence", and "error" for a
+    section whose grid was rejected. render_sections can draw the overlays
+    from these.
+    """
+    sections = {}
+    for sec_name, data in results.items():
+        sections[sec_name] = {
+            "row_scores": {int(row): int(score) for row, score in data["row_scores"].items()},
+            "total_score": int(data["total_score"]),
+            "total_columns": int(data["total_columns"]),
+            "answers": [[int(v) for v in row] for row in data["answers"]],
+            "y_coords": [int(y) for y in data.get("y_coords", [])],
+            "x_coords": [int(x) for x in data.get("x_coords", [])],
+        }
+        if "box" in data:
+            sections[sec_name]["box"] = [int(v) for v in data["box"]]
+        if "error" in data:
+            sections[sec_name]["error"] = data["error"]
+        if "confidence" in data:
+            sections[sec_name]["confidence"] = {
+                int(row): round(float(c), 3) for row, c in data["confidence"].items()
+            }
+    return sections
+
+def canonical_page(img, align=True, template=None, corners=None):
+    """
+    Bring a sheet into the frame the boxes of its form template are measured
+    in (800x1000 for the TER form): warp the answer table onto the form's
+    table corners (align.py; corners when already found), or only resize
+    when align is False.
+    """
+    form = template or get_template()
+    if align:
+        # Warp the answer table onto its canonical position (or just resize
+        # when the sheet is already straight) so the section boxes line up.
+        with instrument.timer("align"):
+            resized, _ = align_page(img, form, corners)
+        return resized
+    if (img.shape[1], img.shape[0]) == form.page_size:
+        # Images from loader.load_scan already have the right size
+        return img
+    return cv2.resize(img, form.page_size)
+
+def render_sections(img, results, align=True, sections=None, template=None):
+    """
+    Draw the overlays of already scored sections: the grid the answers were
+    read from and a circle on every marked cell. Meant to be called only when
+    a section is actually shown, so scoring never pays for the drawing.
+    
+    Input:
+      img: the sheet the results were computed from (as given to process_sections).
+      results: the output of process_sections or plain_results.
+      align: must match the align argument used for scoring.
+      sections: names of the sections to draw (default: all).
+      template: the form template the results were scored with.
+      
+    Returns:
+      a dict mapping section name -> BGR image of the section with overlays.
+    """
+    form = template or get_template()
+    page = canonical_page(img, align, form)
+    overlays = {}
+    for sec_name in sections or results:
+        data = results[sec_name]
+        y0, y1, x0, x1 = data.get("box") or form.section_boxes[sec_name]
+        output = page[y0:y1, x0:x1].copy()
+        y_coords, x_coords = data.get("y_coords", []), data.get("x_coords", [])
+        for y in y_coords:
+            cv2.line(output, (0, int(y)), (output.shape[1], int(y)), (0, 255, 0), 2)
+        for x in x_coords:
+            cv2.line(output, (int(x), 0), (int(x), output.shape[0]), (0, 255, 0), 2)
+        
+        # Circles as detected when available, else the centre of every marked cell.
+        if "unique_cells" in data:
+            circles = list(data["unique_cells"].values())
+        else:
+            circles = []
+            for row, col in zip(*np.nonzero(np.asarray(data["answers"]))):
+                if row + 1 < len(y_coords) and col + 1 < len(x_coords):
+                    cy0, cy1 = y_coords[row], y_coords[row + 1]
+                    cx0, cx1 = x_coords[col], x_coords[col + 1]
+                    circles.append(((cx0 + cx1) // 2, (cy0 + cy1) // 2,
+                                    min(cx1 - cx0, cy1 - cy0) // 2))
+        overlays[sec_name] = utils.draw_circles(output, circles)
+    return overlays
+
+def split_table(page, table_planes, profile=None, template=None):
+    """
+    Find the sections of the answer table of an aligned page with one
+    utils.detect_table_grid pass over the form's table_box (table_planes:
+    utils.preprocess of that area).
+    
+    Returns:
+      boxes: section name -> (y0, y1, x0, x1) in the aligned image, just
+             around the section's grid.
+      grids: section name -> (y_coords, x_coords) relative to its box.
+      Both are None when the table does not split into the sections of
+      the form (in the same order).
+    """
+    form = template or get_template()
+    table_y0, table_y1, table_x0, table_x1 = form.table_box
+    found = utils.detect_table_grid(page[table_y0:table_y1, table_x0:table_x1],
+                                    planes=table_planes, params=profile)
+    if len(found) != len(form.sections):
+        return None, None
+    
+    boxes = {}
+    grids = {}
+    for sec_name, (y_coords, x_coords) in zip(form.sections, found):
+        y0 = max(y_coords[0] - TABLE_MARGIN, 0)
+        y1 = min(y_coords[-1] + TABLE_MARGIN + 1, table_y1 - table_y0)
+        x0 = max(min(x_coords) - TABLE_MARGIN, 0)
+        x1 = min(max(x_coords) + TABLE_MARGIN + 1, table_x1 - table_x0)
+        boxes[sec_name] = (table_y0 + y0, table_y0 + y1, table_x0 + x0, table_x0 + x1)
+        grids[sec_name] = ([y - y0 for y in y_coords], [x - x0 for x in x_coords])
+    return boxes, grids
+
+def table_mode(table=None, profile=None):
+    """Whether process_sections runs in table mode: table, else the profile's setting."""
+    if table is None:
+        return (profile or DEFAULT_PARAMS)["grid"]["table"]
+    return table
+
+def grid_method(sec_name, grid=None, profile=None):
+    """
+    Grid finder of a section: "hough" (utils.detect_horizontal_lines and
+    detect_vertical_lines) or "projection" (utils.detect_grid_projection).
+    grid is a method name for every section or a {section: method} dict;
+    sections it does not name use the profile's "grid" settings.
+    """
+    method = grid.get(sec_name) if isinstance(grid, dict) else grid
+    if method is None:
+        settings = (profile or DEFAULT_PARAMS)["grid"]
+        method = settings["sections"].get(sec_name, settings["method"])
+    if method not in GRID_METHODS:
+        raise ValueError(f"Unknown grid method {method!r} for {sec_name}")
+    return method
+
+@instrument.timed("process_sections")
+def process_sections(img, progress=None, workers=None, layout_cache=None, scorer="fill",
+                     align=True, draw=False, profile=None, grid=None, table=None,
+                     template=None, corners=None):
     """
     Process the full image by dividing it into sections,
     detecting horizontal and vertical lines and circles in each section,
@@ -10,6 +248,40 @@ def process_sections(img):
     
     Input:
       img: the input image.
+      progress: optional callback progress(done, total, stage), called before
+                each section and once at the end. It may raise to abort the
+                processing (this is how the dashboard cancels a scan).
+      workers: when greater than 1, run the detectors of all sections on a
+               thread pool of this size. The results are the same as the
+               sequential run.
+      layout_cache: optional layout.LayoutCache. Sections whose cached grid
+                    still matches this sheet skip line detection; confident
+                    detections are added to the cache.
+      scorer: "fill" (default) picks the cell with the most ink in every row
+              (scoring.py) and adds a per-row "confidence" to the section
+              results; "hough" finds the encircled answers with HoughCircles.
+      align: find the answer table and warp the sheet so it sits where the
+             section boxes expect it (align.py); False only resizes.
+      draw: also draw the detections on a copy of every section ("output").
+            Off by default; use render_sections to draw them when needed.
+      profile: detector settings of a scanner profile (profiles.get_profile);
+               None uses the default profile.
+      grid: grid finder, for all sections ("hough" or "projection") or per
+            section ({section: method}); None takes it from the profile
+            (see grid_method).
+      table: find the grids of all sections in one pass over the whole
+             answer table (split_table) instead of cropping the section
+             boxes and finding each section's grid on its own. The layout
+             cache is not used then (pass table=False with a calibrated
+             layout). A table that does not split into the form's sections
+             falls back to the section boxes. None takes it from the profile.
+      template: the form (template.get_template) the sheet is printed on;
+                None uses the default form.
+      corners: the answer table's corners in img when they are already
+               known (identify.identify_form returns them), so align does
+               not look for them again.
+    
+    Timings and counters of every stage go to the instrument.py sinks.
       
     Returns:
       results: a dictionary where each key is a section name and the value is
@@ -18,153 +290,162 @@ def process_sections(img):
                  - "row_scores": a dict mapping row number to its score (for display)
                  - "total_score": total score for that section
                  - "total_columns": number of columns (for computing scores)
-                 - "output": the processed section image with circles drawn
+                 - "answers": (rows x columns) matrix with 1 in every marked cell
+                 - "y_coords", "x_coords": the row and column lines used
+                 - "box": the section's (y0, y1, x0, x1) in the aligned image
+                 - "output": the section image with circles drawn (None
+                   unless draw is True)
+                 - "error": why the section was not scored, when its grid
+                   does not have the form's rows and columns (no scores
+                   then; see section_errors)
     """
-    # Resize image
-    resized = cv2.resize(img, (800, 1000))
+    form = template or get_template()
+    resized = canonical_page(img, align, form, corners)
+    table = table_mode(table, profile)
     
-    # Define sections dictionary; each section is processed independently.
-    sections = {
-        "Section 1": resized[222:352, 530:750],
-        "Section 2": resized[365:513, 535:743],
-        "Section 3": resized[529:690, 535:743],
-        "Section 4": resized[705:870, 535:743],
-    }
+    # Grayscale/blur/binarize the answer area (the whole table in table
+    # mode) once, each plane when a detector first asks for it; every
+    # detector gets views of these planes instead of redoing the
+    # conversions per section.
+    area_y0, area_y1, area_x0, area_x1 = form.table_box if table else form.area_box
+    with instrument.timer("preprocess"):
+        area_planes = utils.preprocess(resized[area_y0:area_y1, area_x0:area_x1])
     
-    # Mapping of internal section names to the titles for printing
-    section_titles = {
-        "Section 1": "Commitment",
-        "Section 2": "Knowledge of Subject",
-        "Section 3": "Teaching for Independent Learning",
-        "Section 4": "Management of Learning"
-    }
+    # Section boxes: found in the table, or the form's fixed boxes.
+    table_boxes = table_grids = None
+    if table:
+        table_boxes, table_grids = split_table(resized, area_planes, profile, form)
+        if table_boxes is None:
+            instrument.count("table_fallback")
     
-    # Mapping of section to its questions per row.
-    # Update these texts as needed.
-    section_questions = {
-        "Section 1": {
-            1: "demonstrate sensitivity to students' ability to attend and absorb content information",
-            2: "exhibit readiness and enthusiasm for professional development",
-            3: "display consistency in teaching methodology",
-            4: "adapt teaching to meet student needs",
-            5: "engage students with diverse learning styles"
-        },
-        "Section 2": {
-            1: "present subject matter with clarity",
-            2: "use relevant examples and explanations",
-            3: "integrate current research into teaching",
-            4: "demonstrate mastery of core content",
-            5: "address questions effectively"
-        },
-        "Section 3": {
-            1: "encourage independent inquiry",
-            2: "provide effective feedback",
-            3: "support collaborative learning",
-            4: "promote critical thinking",
-            5: "use technology to enhance learning"
-        },
-        "Section 4": {
-            1: "organize classroom effectively",
-            2: "manage time efficiently",
-            3: "set clear learning objectives",
-            4: "maintain a positive classroom climate",
-            5: "evaluate student progress fairly"
+    # Define sections dictionary; each section is processed independently.
+    # The form's own boxes were turned into slices once, when it was loaded.
+    if table_boxes is not None:
+        section_boxes = table_boxes
+        sections = {
+            sec_name: resized[y0:y1, x0:x1]
+            for sec_name, (y0, y1, x0, x1) in section_boxes.items()
+        }
+    else:
+        section_boxes = form.section_boxes
+        sections = {sec_name: resized[section.page_slice]
+                    for sec_name, section in form.sections.items()}
+    if table:
+        section_planes = {
+            sec_name: utils.crop_planes(area_planes, y0 - area_y0, y1 - area_y0,
+                                        x0 - area_x0, x1 - area_x0)
+            for sec_name, (y0, y1, x0, x1) in section_boxes.items()
+        }
+    else:
+        section_planes = {
+            sec_name: utils.Planes(parent=area_planes, region=section.area_slice)
+            for sec_name, section in form.sections.items()
         }
-    }
     
     results = {}
     
-    for sec_name, sec_img in sections.items():
-        print(f"\nProcessing {sec_name}:")
-        
-        # Detect horizontal lines to get row boundaries.
-        output_h, y_coords = utils.detect_horizontal_lines(sec_img, section_name=sec_name)
-        
-        # Compute row ranges based on filtered y-coordinates.
-        rows = []
-        for i in range(len(y_coords) - 1):
-            row_range = (int(y_coords[i]), int(y_coords[i+1]))
-            rows.append(row_range)
-        
-        # Detect vertical lines to get column boundaries.
-        output_v, x_coords = utils.detect_vertical_lines(sec_img, section_name=sec_name)
-        
-        # Compute column ranges from filtered x-coordinates.
-        columns = []
-        for i in range(len(x_coords) - 1):
-            col_range = (int(x_coords[i]), int(x_coords[i+1]))
-            columns.append(col_range)
-        
-        # Detect circles in the section.
-        output_c, circles = utils.detect_circles(sec_img, section_name=sec_name)
-        
-        # For each detected circle, determine which column and row it falls into.
-        circle_assignments = []
-        for (x, y, r) in circles:
-            col_assigned = None
-            row_assigned = None
+    # Sections whose row/column grid is already known (found in the table, or
+    # cached and still matching this sheet) skip the line detectors; a cached
+    # grid that no longer matches is dropped.
+    known_grids = dict(table_grids or {})
+    if layout_cache is not None and not table:
+        for sec_name in sections:
+            cached = layout_cache.get(form.id, sec_name)
+            if cached is None:
+                continue
+            if layout.verify_grid(section_planes[sec_name], cached):
+                known_grids[sec_name] = cached
+            else:
+                layout_cache.invalidate(form.id, sec_name)
+    
+    # With workers > 1 every detector of every section is started up front on
+    # a thread pool (the OpenCV calls release the GIL); the results are still
+    # consumed section by section, in order, below.
+    executor = None
+    futures = {}
+    if workers is not None and workers > 1:
+        executor = ThreadPoolExecutor(max_workers=workers)
+        for sec_name, sec_img in sections.items():
+            planes = section_planes[sec_name]
+            futures[sec_name] = {}
+            if scorer == "hough":
+                futures[sec_name]["circles"] = executor.submit(
+                    instrument.bind(utils.detect_circles), sec_img,
+                    section_name=sec_name, planes=planes, draw=draw, params=profile)
+            if sec_name in known_grids:
+                continue
+            if grid_method(sec_name, grid, profile) == "projection":
+                futures[sec_name]["grid"] = executor.submit(
+                    instrument.bind(utils.detect_grid_projection), sec_img,
+                    section_name=sec_name, planes=planes, draw=draw, params=profile)
+            else:
+                futures[sec_name]["horizontal"] = executor.submit(
+                    instrument.bind(utils.detect_horizontal_lines), sec_img,
+                    section_name=sec_name, planes=planes, draw=draw, params=profile)
+                futures[sec_name]["vertical"] = executor.submit(
+                    instrument.bind(utils.detect_vertical_lines), sec_img,
+                    section_name=sec_name, planes=planes, draw=draw, params=profile)
+    
+    try:
+        for sec_index, (sec_name, sec_img) in enumerate(sections.items()):
+            if progress is not None:
+                progress(sec_index, len(sections), sec_name)
+            with instrument.timer("section", section=sec_name):
+                planes = section_planes[sec_name]
+                if sec_name in known_grids:
+                    # Grid from the table or the layout cache; no line detection needed.
+                    y_coords, x_coords = known_grids[sec_name]
+                elif "grid" in futures.get(sec_name, {}):
+                    output_g, y_coords, x_coords = futures[sec_name]["grid"].result()
+                elif "horizontal" in futures.get(sec_name, {}):
+                    output_h, y_coords = futures[sec_name]["horizontal"].result()
+                    output_v, x_coords = futures[sec_name]["vertical"].result()
+                elif grid_method(sec_name, grid, profile) == "projection":
+                    # Row and column rules from the ink profiles, in one pass.
+                    output_g, y_coords, x_coords = utils.detect_grid_projection(
+                        sec_img, section_name=sec_name, planes=planes, draw=draw,
+                        params=profile)
+                else:
+                    # Detect horizontal lines to get row boundaries.
+                    output_h, y_coords = utils.detect_horizontal_lines(
+                        sec_img, section_name=sec_name, planes=planes, draw=draw,
+                        params=profile)
+                    # Detect vertical lines to get column boundaries.
+                    output_v, x_coords = utils.detect_vertical_lines(
+                        sec_img, section_name=sec_name, planes=planes, draw=draw,
+                        params=profile)
             
-            # Determine column based on x-coordinate.
-            for idx, (start, end) in enumerate(columns):
-                if start <= x < end:
-                    col_assigned = idx + 1  # Columns numbered starting at 1
-                    break
+                confidence = None
+                if scorer == "fill":
+                    # Pick the darkest cell of every row from the grid just found.
+                    with instrument.timer("scoring", section=sec_name):
+                        circles, confidence = scoring.fill_marks(planes["binary"], y_coords,
+                                                                 x_coords)
+                    output_c = utils.draw_circles(sec_img.copy(), circles) if draw else None
+                elif sec_name in futures:
+                    output_c, circles = futures[sec_name]["circles"].result()
+                else:
+                    # Detect circles in the section.
+                    output_c, circles = utils.detect_circles(sec_img, section_name=sec_name,
+                                                             planes=planes, draw=draw,
+                                                             params=profile)
             
-            # Determine row based on y-coordinate.
-            for idx, (start, end) in enumerate(rows):
-                if start <= y < end:
-                    row_assigned = idx + 1  # Rows numbered starting at 1
-                    break
+                # Remember a grid with exactly the expected rows and columns.
+                if layout_cache is not None and not table and sec_name not in known_grids:
+                    expected_rows = form.sections[sec_name].expected_rows
+                    if layout.is_confident(y_coords, x_coords, expected_rows, form.columns):
+                        layout_cache.put(form.id, sec_name, y_coords, x_coords)
             
-            if col_assigned is not None and row_assigned is not None:
-                circle_assignments.append((row_assigned, col_assigned, x, y, r))
-            else:
-                print(f"{sec_name} - Circle at ({x}, {y}) did not fall within a proper cell range.")
-        
-        # Sort assignments by row then by column.
-        circle_assignments.sort(key=lambda item: (item[0], item[1]))
-        
-        # Filter out duplicate circles in the same cell (only one per cell).
-        unique_cells = {}
-        for (row, col, x, y, r) in circle_assignments:
-            cell_key = (row, col)
-            if cell_key not in unique_cells:
-                unique_cells[cell_key] = (x, y, r)
+                results[sec_name] = score_section(sec_name, y_coords, x_coords, circles,
+                                                  output_c, confidence, form)
+                results[sec_name]["box"] = section_boxes[sec_name]
+    finally:
+        if executor is not None:
+            # Drop the detectors that have not started yet if we stop early.
+            executor.shutdown(cancel_futures=True)
         
-        # Compute total score for the section.
-        # Score is computed as: score = (total_columns + 1) - col.
-        total_columns = len(columns)  # e.g., if there are 6 vertical lines then there are 5 columns.
-        section_total_score = 0
-        
-        # Prepare a mapping of row number to score.
-        row_scores = {}
-        for (row, col), (x, y, r) in sorted(unique_cells.items(), key=lambda item: (item[0][0], item[0][1])):
-            score = (total_columns + 1) - col
-            section_total_score += score
-            # If a row has multiple cells, you might decide to sum them or choose one.
-            # Here we assume one circle per row; if multiple, later ones overwrite.
-            row_scores[row] = score
-        
-        # Print the results in the desired format.
-        section_title = section_titles.get(sec_name, sec_name)
-        print(f"\n{section_title}:")
-        for row_index in sorted(row_scores.keys()):
-            question_text = section_questions.get(sec_name, {}).get(row_index, f"Row {row_index}")
-            print(f"{row_index}. {question_text}: {row_scores[row_index]}")
-        print(f"Total Score: {section_total_score}")
-        
-        # Store results for the section.
-        results[sec_name] = {
-            "unique_cells": unique_cells,
-            "row_scores": row_scores,
-            "total_score": section_total_score,
-            "total_columns": total_columns,
-            "output": output_c  # Processed section image with circles drawn.
-            
-        }
-        
-    
-    
+    if progress is not None:
+        progress(len(sections), len(sections), "Done")
     
     return results
 
@@ -0,0 +1,131 @@
+import os
+import sys
+import copy
+import json
+
+# Named scanner profiles: the HoughCircles, HoughLinesP and morphology
+# settings of the detectors in utils.py, tuned per scanner (see calibrate.py).
+DEFAULT_PROFILES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                     "profiles.json")
+
+# Profile used when none is asked for (and the TER_PROFILE variable is not set).
+DEFAULT_PROFILE = "default"
+PROFILE_ENV = "TER_PROFILE"
+
+# The settings the detectors were hand-tuned with. A profile only has to
+# list the values it changes; everything else comes from here.
+DEFAULT_PARAMS = {
+    "circles": {
+        "dp": 1.5,
+        "min_dist": 10,
+        "param1": 100,
+        "param2": 30,
+        "min_radius": 5,
+        "max_radius": 14,
+    },
+    # Column rules run the height of a section; kernel_height and
+    # min_line_length are kept above the largest mark (2 * max_radius) so
+    # the stroke of a mark is not taken for a rule.
+    "vertical": {
+        "kernel_height": 30,
+        "threshold": 6,
+        "min_line_length": 40,
+        "max_line_gap": 300,
+    },
+    "horizontal": {
+        "kernel_width": 40,
+        "bridge_width": 10,
+        "rho": 1.5,
+        "threshold": 30,
+        "min_line_length": 8,
+        "max_line_gap": 1000,
+    },
+    # Projection-profile grid finder (utils.detect_grid_projection): ink
+    # strokes shorter than min_rule_length are dropped (marks, text), then a
+    # pixel row/column is part of a rule when this fraction of it is ink.
+    "projection": {
+        "min_rule_length": 15,
+        "min_coverage": 0.3,
+        # A band this many rows tall is searched again for a rule that
+        # broke up, which counts when this fraction of it is ink (see
+        # utils.find_faint_rules).
+        "faint_gap": 1.75,
+        "faint_coverage": 0.1,
+        # Whole-table mode (utils.detect_table_grid): how many pixels a
+        # column rule may be off between two sections.
+        "column_drift": 4,
+    },
+    # The whole answer table is read in one pass (main.split_table). With
+    # "table" off (or when the table does not split) every section is read
+    # on its own by "method": "hough" (morphology + HoughLinesP) or
+    # "projection"; "sections" overrides it per section name.
+    "grid": {
+        "method": "hough",
+        "sections": {},
+        "table": True,
+    },
+    # Lines closer than this many pixels are merged into one.
+    "merge_distance": 10,
+}
+
+
+def merge_params(base, changes):
+    """Copy of base with the (possibly nested) values of changes on top."""
+    merged = copy.deepcopy(base)
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_params(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def load_profiles(path=None):
+    """
+    Read a profiles file: {name: {"description": ..., "params": {...}}}.
+    A missing file gives no profiles (only the built-in default).
+    """
+    try:
+        with open(path or DEFAULT_PROFILES_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def get_profile(name=None, path=None):
+    """
+    Detector settings of a named profile, filled in from DEFAULT_PARAMS.
+    name defaults to the TER_PROFILE environment variable, then "default".
+    Raises KeyError for a profile that is not in the file.
+    """
+    name = name or os.environ.get(PROFILE_ENV) or DEFAULT_PROFILE
+    profiles = load_profiles(path)
+    if name not in profiles:
+        if name == DEFAULT_PROFILE:
+            return copy.deepcopy(DEFAULT_PARAMS)
+        raise KeyError(f"No scanner profile named {name!r} in {path or DEFAULT_PROFILES_PATH}")
+    return merge_params(DEFAULT_PARAMS, profiles[name].get("params", {}))
+
+
+def save_profile(name, params, path=None, description=""):
+    """Add (or replace) a profile in the profiles file."""
+    path = path or DEFAULT_PROFILES_PATH
+    profiles = load_profiles(path)
+    profiles[name] = {"description": description, "params": params}
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(profiles, f, indent=2)
+        f.write("\n")
+    os.replace(tmp_path, path)
+
+
+def fingerprint(params):
+    """Stable text form of a profile, e.g. for cache keys."""
+    return json.dumps(params, sort_keys=True)
+
+
+if __name__ == "__main__":
+    # List the profiles in a file (default: profiles.json).
+    profiles_path = sys.argv[1] if len(sys.argv) > 1 else None
+    for profile_name, profile in sorted(load_profiles(profiles_path).items()):
+        print(f"{profile_name}: {profile.get('description', '')}")
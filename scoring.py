@@ -0,0 +1,127 @@
+import cv2
+import numpy as np
+
+# Fraction of a cell's height/width ignored on each side, so the printed
+# grid lines themselves are not counted as ink.
+CELL_INSET = 0.1
+
+# A row counts as answered when its darkest cell has at least this much
+# more ink (relative) than the runner-up: confidence = (best - second) / best.
+MIN_CONFIDENCE = 0.2
+
+
+def cell_fill_ratios(binary, y_coords, x_coords, inset=CELL_INSET):
+    """
+    Fraction of ink pixels in every cell of the grid, computed for all cells
+    at once from the integral image of the binarized section.
+
+    Input:
+      binary: binarized section, ink non-zero (e.g. the "binary" plane of
+              utils.preprocess).
+      y_coords, x_coords: sorted row and column line positions.
+
+    Returns:
+      a (rows x columns) float array, empty if the grid has no cells.
+    """
+    ys = np.asarray(y_coords, dtype=np.int64)
+    xs = np.asarray(x_coords, dtype=np.int64)
+    if len(ys) < 2 or len(xs) < 2:
+        return np.zeros((max(len(ys) - 1, 0), max(len(xs) - 1, 0)))
+
+    # Cell bounds, shrunk by the inset on every side.
+    dy = (np.diff(ys) * inset).astype(np.int64)
+    dx = (np.diff(xs) * inset).astype(np.int64)
+    top, bottom = ys[:-1] + dy, ys[1:] - dy
+    left, right = xs[:-1] + dx, xs[1:] - dx
+
+    integral = cv2.integral((binary > 0).view(np.uint8))
+    ink = (integral[np.ix_(bottom, right)] - integral[np.ix_(top, right)]
+           - integral[np.ix_(bottom, left)] + integral[np.ix_(top, left)])
+    area = np.outer(bottom - top, right - left)
+    return ink / np.maximum(area, 1)
+
+
+def pick_marks(ratios, min_confidence=MIN_CONFIDENCE):
+    """
+    Pick the marked column of every row of a fill-ratio grid.
+
+    Returns:
+      columns: 0-based marked column per row, -1 where no cell stands out.
+      confidence: (best - second) / best per row, 0 for an empty row.
+    """
+    rows, cols = ratios.shape
+    if rows == 0 or cols == 0:
+        return np.full(rows, -1), np.zeros(rows)
+
+    best = ratios.max(axis=1)
+    second = np.sort(ratios, axis=1)[:, -2] if cols > 1 else np.zeros(rows)
+    confidence = np.where(best > 0, (best - second) / np.where(best > 0, best, 1), 0.0)
+    columns = np.where(confidence >= min_confidence, ratios.argmax(axis=1), -1)
+    return columns, confidence
+
+
+def fill_marks(binary, y_coords, x_coords):
+    """
+    Score a section by fill ratio instead of circle detection.
+
+    Returns:
+      circles: one (x, y, r) per answered row, centred on the marked cell,
+               in the same form detect_circles returns.
+      confidence: dict mapping row number (from 1) to its confidence.
+    """
+    ratios = cell_fill_ratios(binary, y_coords, x_coords)
+    columns, confidence = pick_marks(ratios)
+
+    circles = []
+    for row, col in enumerate(columns):
+        if col < 0:
+            continue
+        y0, y1 = int(y_coords[row]), int(y_coords[row + 1])
+        x0, x1 = int(x_coords[col]), int(x_coords[col + 1])
+        circles.append(((x0 + x1) // 2, (y0 + y1) // 2, min(x1 - x0, y1 - y0) // 2))
+
+    return circles, {row + 1: float(c) for row, c in enumerate(confidence)}
+
+
+def assign_cells(circles, y_coords, x_coords):
+    """
+    Assign every circle (x, y, r) to the grid cell it falls in, all at once:
+    one np.searchsorted per axis bins the centres, and only the first circle
+    (in detection order) found in a cell is kept.
+
+    A circle belongs to row i when y_coords[i] <= y < y_coords[i + 1] (and
+    likewise for columns); rows and columns are numbered from 1.
+
+    Returns:
+      cells: list of (row, col, x, y, r), one per occupied cell, sorted by
+             row and then column.
+      unassigned: list of (x, y) for circles outside the grid.
+      answers: (rows x columns) uint8 matrix with 1 in every occupied cell.
+    """
+    ys = np.asarray(y_coords, dtype=np.int64)
+    xs = np.asarray(x_coords, dtype=np.int64)
+    n_rows, n_cols = max(len(ys) - 1, 0), max(len(xs) - 1, 0)
+    answers = np.zeros((n_rows, n_cols), dtype=np.uint8)
+
+    points = np.asarray(circles, dtype=np.int64).reshape(-1, 3)
+    if len(points) == 0:
+        return [], [], answers
+
+    rows = np.searchsorted(ys, points[:, 1], side="right") - 1
+    cols = np.searchsorted(xs, points[:, 0], side="right") - 1
+    inside = (rows >= 0) & (rows < n_rows) & (cols >= 0) & (cols < n_cols)
+
+    # np.unique returns the index of the first occurrence of every cell id,
+    # with the ids (row-major) in ascending order.
+    inside_idx = np.flatnonzero(inside)
+    cell_ids = rows[inside_idx] * n_cols + cols[inside_idx]
+    _, first = np.unique(cell_ids, return_index=True)
+    keep = inside_idx[first]
+    answers[rows[keep], cols[keep]] = 1
+
+    cells = [
+        (int(rows[i]) + 1, int(cols[i]) + 1, int(x), int(y), int(r))
+        for i, (x, y, r) in zip(keep, points[keep])
+    ]
+    unassigned = [(int(x), int(y)) for x, y, _ in points[~inside]]
+    return cells, unassigned, answers
@@ -0,0 +1,206 @@
+import os
+import time
+import sqlite3
+
+from template import DEFAULT_FORM
+
+# Default database, kept in the user's home folder so it survives app
+# updates (and is never inside the PyInstaller temp folder).
+DEFAULT_DB_PATH = os.path.join(os.path.expanduser("~"), "cnsc_ter_results.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sheets (
+    id          INTEGER PRIMARY KEY,
+    path        TEXT,
+    faculty     TEXT,
+    term        TEXT,
+    form        TEXT,
+    scanned_at  REAL NOT NULL,
+    total_score INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS section_scores (
+    sheet_id      INTEGER NOT NULL REFERENCES sheets(id) ON DELETE CASCADE,
+    section       TEXT NOT NULL,
+    total_score   INTEGER NOT NULL,
+    total_columns INTEGER NOT NULL,
+    PRIMARY KEY (sheet_id, section)
+);
+CREATE TABLE IF NOT EXISTS row_scores (
+    sheet_id   INTEGER NOT NULL REFERENCES sheets(id) ON DELETE CASCADE,
+    section    TEXT NOT NULL,
+    row        INTEGER NOT NULL,
+    score      INTEGER NOT NULL,
+    confidence REAL,
+    PRIMARY KEY (sheet_id, section, row)
+);
+CREATE INDEX IF NOT EXISTS idx_sheets_faculty ON sheets(faculty, term);
+CREATE INDEX IF NOT EXISTS idx_sheets_term ON sheets(term);
+CREATE INDEX IF NOT EXISTS idx_sheets_form ON sheets(form);
+CREATE INDEX IF NOT EXISTS idx_section_scores_section ON section_scores(section);
+CREATE INDEX IF NOT EXISTS idx_row_scores_section ON row_scores(section, row);
+"""
+
+
+class ResultStore:
+    """
+    SQLite store of scored sheets: one row per sheet, per section and per
+    question row, as produced by main.process_sections. Every sheet records
+    the form (template.py) it was scored as, since "Section 1 row 3" means a
+    different question on another form revision.
+
+    The database runs in WAL mode so the Results page can read while a batch
+    is writing, and add_sheets() writes any number of sheets in a single
+    transaction. A store object must be used from one thread only.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self._migrate()
+        self.conn.executescript(SCHEMA)
+
+    def _migrate(self):
+        """Bring a database written by an older version up to SCHEMA."""
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(sheets)")]
+        if columns and "form" not in columns:
+            # Before form templates there was only the one TER form.
+            with self.conn:
+                self.conn.execute("ALTER TABLE sheets ADD COLUMN form TEXT")
+                self.conn.execute("UPDATE sheets SET form = ?", (DEFAULT_FORM,))
+
+    def close(self):
+        self.conn.close()
+
+    def add_sheet(self, results, path=None, faculty=None, term=None, form=DEFAULT_FORM):
+        """Store one sheet and return its id."""
+        return self.add_sheets([(results, path, faculty, term, form)])[0]
+
+    def add_sheets(self, sheets):
+        """
+        Store many sheets in one transaction.
+
+        Input:
+          sheets: iterable of (results, path, faculty, term, form), where
+                  results maps section name -> dict with "row_scores",
+                  "total_score", "total_columns" and optionally "confidence"
+                  (the output of process_sections or the "sections" of a
+                  batch result) and form is the id of the form it was
+                  scored as.
+
+        Returns:
+          the list of new sheet ids.
+        """
+        ids = []
+        section_rows = []
+        score_rows = []
+        now = time.time()
+        with self.conn:
+            for results, path, faculty, term, form in sheets:
+                total = sum(int(data["total_score"]) for data in results.values())
+                cursor = self.conn.execute(
+                    "INSERT INTO sheets (path, faculty, term, form, scanned_at, total_score) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (path, faculty, term, form, now, total),
+                )
+                sheet_id = cursor.lastrowid
+                ids.append(sheet_id)
+                for sec_name, data in results.items():
+                    section_rows.append((sheet_id, sec_name, int(data["total_score"]),
+                                         int(data["total_columns"])))
+                    confidence = data.get("confidence", {})
+                    for row, score in data["row_scores"].items():
+                        c = confidence.get(row)
+                        score_rows.append((sheet_id, sec_name, int(row), int(score),
+                                           None if c is None else float(c)))
+            self.conn.executemany(
+                "INSERT INTO section_scores (sheet_id, section, total_score, total_columns) "
+                "VALUES (?, ?, ?, ?)", section_rows)
+            self.conn.executemany(
+                "INSERT INTO row_scores (sheet_id, section, row, score, confidence) "
+                "VALUES (?, ?, ?, ?, ?)", score_rows)
+        return ids
+
+    def latest_sheet_id(self):
+        row = self.conn.execute("SELECT MAX(id) FROM sheets").fetchone()
+        return row[0]
+
+    def load_sheet(self, sheet_id):
+        """
+        Load a stored sheet.
+
+        Returns:
+          (info, results): info is a dict of the sheet's path, faculty, term,
+          form, scanned_at and total_score; results maps section name -> dict with
+          "row_scores", "total_score" and "total_columns", like the output of
+          process_sections (without images). None if there is no such sheet.
+        """
+        row = self.conn.execute(
+            "SELECT path, faculty, term, form, scanned_at, total_score FROM sheets WHERE id = ?",
+            (sheet_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        info = dict(zip(("path", "faculty", "term", "form", "scanned_at", "total_score"), row))
+
+        results = {}
+        for section, total, columns in self.conn.execute(
+                "SELECT section, total_score, total_columns FROM section_scores "
+                "WHERE sheet_id = ? ORDER BY section", (sheet_id,)):
+            results[section] = {"row_scores": {}, "total_score": total, "total_columns": columns}
+        for section, row_num, score in self.conn.execute(
+                "SELECT section, row, score FROM row_scores WHERE sheet_id = ? "
+                "ORDER BY section, row", (sheet_id,)):
+            results[section]["row_scores"][row_num] = score
+        return info, results
+
+    def forms(self, faculty=None, term=None):
+        """Ids of the forms of the stored sheets, optionally only one faculty/term."""
+        query, params = self._filter("SELECT DISTINCT form FROM sheets WHERE 1 = 1",
+                                     faculty, term)
+        return [row[0] for row in self.conn.execute(query + " ORDER BY form", params)]
+
+    def sheets(self, faculty=None, term=None, form=None):
+        """(id, faculty) of every stored sheet, optionally only one faculty/term/form."""
+        query, params = self._filter("SELECT id, faculty FROM sheets WHERE 1 = 1",
+                                     faculty, term, form)
+        return self.conn.execute(query + " ORDER BY id", params).fetchall()
+
+    def section_row_scores(self, faculty=None, term=None, form=None):
+        """
+        Every stored question score, optionally only for one faculty, term
+        and/or form, grouped by section: a dict mapping section name -> list
+        of (sheet_id, row, score). Plain integer rows keep this fast enough
+        to read tens of thousands of sheets at once.
+        """
+        sections = [row[0] for row in self.conn.execute(
+            "SELECT DISTINCT section FROM section_scores ORDER BY section")]
+        # The join is only needed to filter.
+        query = "SELECT r.sheet_id, r.row, r.score FROM row_scores r"
+        if faculty is not None or term is not None or form is not None:
+            query += " JOIN sheets ON sheets.id = r.sheet_id"
+        query, params = self._filter(query + " WHERE r.section = ?", faculty, term, form)
+        scores = {}
+        for section in sections:
+            scores[section] = self.conn.execute(query, [section] + params).fetchall()
+        return scores
+
+    def _filter(self, query, faculty, term, form=None):
+        params = []
+        if faculty is not None:
+            query += " AND sheets.faculty = ?"
+            params.append(faculty)
+        if term is not None:
+            query += " AND sheets.term = ?"
+            params.append(term)
+        if form is not None:
+            query += " AND sheets.form = ?"
+            params.append(form)
+        return query, params
+
+    def count_sheets(self, faculty=None, term=None, form=None):
+        query, params = self._filter("SELECT COUNT(*) FROM sheets WHERE 1 = 1",
+                                     faculty, term, form)
+        return self.conn.execute(query, params).fetchone()[0]
@@ -0,0 +1,142 @@
+import os
+import sys
+import json
+import functools
+
+import numpy as np
+
+# Form definitions (one JSON file per printed revision of the form).
+FORMS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "forms")
+
+# Form used when none is asked for.
+DEFAULT_FORM = "ter-v1"
+
+
+class SectionTemplate:
+    """
+    One section of a form, compiled for the scorer.
+
+    Attributes:
+      name, title: section name (the key of the results) and printed title.
+      box: (y0, y1, x0, x1) of the section in the aligned page.
+      page_slice: (rows, columns) slices that crop the box from the page.
+      area_slice: the same relative to the form's answer area (area_box).
+      questions: row number (from 1) -> question text.
+      expected_rows: number of questions, i.e. rows of the grid.
+    """
+
+    def __init__(self, name, title, box, questions, area_origin):
+        self.name = name
+        self.title = title
+        self.box = tuple(box)
+        y0, y1, x0, x1 = self.box
+        self.page_slice = (slice(y0, y1), slice(x0, x1))
+        self.area_slice = (slice(y0 - area_origin[0], y1 - area_origin[0]),
+                           slice(x0 - area_origin[1], x1 - area_origin[1]))
+        self.questions = {row: text for row, text in enumerate(questions, 1)}
+        self.expected_rows = len(self.questions)
+
+
+class FormTemplate:
+    """
+    A printed form revision, compiled once from its definition file.
+
+    Attributes:
+      id, name: form id (e.g. "ter-v1", the layout cache key) and name.
+      page_size: (width, height) of the aligned page the boxes are measured in.
+      table_corners: (4, 2) float32 corners of the answer table's border in
+                     the aligned page (top-left, top-right, bottom-right,
+                     bottom-left), what align.align_page warps onto.
+      table_box: (y0, y1, x0, x1) of the whole answer table (table mode).
+      columns: answer columns per question (the rating scale).
+      descending: True when the leftmost column is the highest rating.
+      column_scores: score of every column, in column order.
+      sections: section name -> SectionTemplate, in page order.
+      section_boxes, titles, questions: section name -> box, title and
+                                        {row: question} lookups.
+      area_box: (y0, y1, x0, x1) around all section boxes, preprocessed once
+                per sheet.
+      area_slice: (rows, columns) slices that crop area_box from the page.
+      signature_box, signature: (y0, y1, x0, x1) of a printed block that
+                                tells this form from the others, and its
+                                hash (identify.py); None when not set.
+    """
+
+    def __init__(self, data):
+        self.id = data["id"]
+        self.name = data.get("name", self.id)
+        self.page_size = tuple(data["page_size"])
+        self.table_corners = np.float32(data["table_corners"])
+        self.table_box = tuple(data["table_box"])
+        self.columns = int(data["scale"]["columns"])
+        self.descending = bool(data["scale"].get("descending", True))
+        if self.descending:
+            self.column_scores = np.arange(self.columns, 0, -1)
+        else:
+            self.column_scores = np.arange(1, self.columns + 1)
+
+        boxes = [section["box"] for section in data["sections"]]
+        self.area_box = (min(box[0] for box in boxes), max(box[1] for box in boxes),
+                         min(box[2] for box in boxes), max(box[3] for box in boxes))
+        self.area_slice = (slice(self.area_box[0], self.area_box[1]),
+                           slice(self.area_box[2], self.area_box[3]))
+        self.sections = {}
+        for section in data["sections"]:
+            self.sections[section["name"]] = SectionTemplate(
+                section["name"], section.get("title", section["name"]), section["box"],
+                section.get("questions", []), (self.area_box[0], self.area_box[2]))
+
+        signature = data.get("signature", {})
+        self.signature_box = tuple(signature["box"]) if "box" in signature else None
+        self.signature = signature.get("hash")
+
+        self.section_boxes = {name: s.box for name, s in self.sections.items()}
+        self.titles = {name: s.title for name, s in self.sections.items()}
+        self.questions = {name: s.questions for name, s in self.sections.items()}
+
+    def column_score(self, col):
+        """Score of a mark in column col (from 1) of a grid of this form."""
+        return int(self.column_scores[col - 1])
+
+
+def load_template(path):
+    """Read and compile a form definition file."""
+    with open(path, "r", encoding="utf-8") as f:
+        return FormTemplate(json.load(f))
+
+
+@functools.lru_cache(maxsize=None)
+def available_forms(forms_dir=FORMS_DIR):
+    """Form id -> definition file, for every form in forms_dir."""
+    forms = {}
+    for name in sorted(os.listdir(forms_dir)):
+        if name.endswith(".json"):
+            path = os.path.join(forms_dir, name)
+            with open(path, "r", encoding="utf-8") as f:
+                forms[json.load(f)["id"]] = path
+    return forms
+
+
+@functools.lru_cache(maxsize=None)
+def get_template(form_id=None, forms_dir=FORMS_DIR):
+    """
+    The compiled template of a form (DEFAULT_FORM when form_id is None).
+    Each form is loaded and compiled once per process.
+    Raises KeyError for a form that is not in forms_dir.
+    """
+    form_id = form_id or DEFAULT_FORM
+    forms = available_forms(forms_dir)
+    if form_id not in forms:
+        raise KeyError(f"No form template {form_id!r} in {forms_dir}")
+    return load_template(forms[form_id])
+
+
+if __name__ == "__main__":
+    # List the known forms and their sections.
+    for known_id in available_forms():
+        form = get_template(known_id)
+        print(f"{form.id}: {form.name}")
+        for section_name, section in form.sections.items():
+            print(f"  {section_name} ({section.title}): {section.expected_rows} question(s), "
+                  f"box {section.box}")
+    sys.exit(0)
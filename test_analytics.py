@@ -0,0 +1,82 @@
+import numpy as np
+
+from analytics import ScoreTable, UNASSIGNED, load_table, summarize
+from store import ResultStore
+
+nan = np.nan
+
+# Three sheets of a 2-section, 2-row form rated 1..5, in storage order.
+# Sheet 2 has a 6 (an answer read from an extra column) that is no score.
+SCORES = np.array([
+    [[5, 4], [3, nan]],      # Dr. B
+    [[2, 6], [nan, nan]],    # Dr. A
+    [[1, 4], [5, 2]],        # Dr. B
+])
+
+
+def table():
+    return ScoreTable(SCORES.copy(), np.array(["Dr. B", "Dr. A", "Dr. B"], dtype=object),
+                      ["Section 1", "Section 2"], np.array([1, 2, 3]), scale=5)
+
+
+def test_summarize_by_hand():
+    """Every figure of summarize against the same figures worked out by hand."""
+    a, b = summarize(table())
+
+    assert (a["faculty"], a["sheets"]) == ("Dr. A", 1)
+    np.testing.assert_array_equal(a["question_means"], [[2, nan], [nan, nan]])
+    np.testing.assert_array_equal(a["responses"], [[1, 0], [0, 0]])
+    np.testing.assert_array_equal(a["out_of_range"], [[0, 1], [0, 0]])
+    np.testing.assert_array_equal(a["distribution"][0, 0], [0, 1, 0, 0, 0])
+    assert a["distribution"].sum() == 1
+    np.testing.assert_array_equal(a["section_means"], [2, nan])
+    np.testing.assert_array_equal(a["section_percentiles"][50], [2, nan])
+    assert a["overall_mean"] == 2.0
+
+    assert (b["faculty"], b["sheets"]) == ("Dr. B", 2)
+    np.testing.assert_array_equal(b["question_means"], [[3, 4], [4, 2]])
+    np.testing.assert_array_equal(b["responses"], [[2, 2], [2, 1]])
+    np.testing.assert_array_equal(b["out_of_range"], [[0, 0], [0, 0]])
+    np.testing.assert_array_equal(b["distribution"], [
+        [[1, 0, 0, 0, 1], [0, 0, 0, 2, 0]],
+        [[0, 0, 1, 0, 1], [0, 1, 0, 0, 0]],
+    ])
+    # Section totals: Section 1 is 9 and 5, Section 2 is 3 and 7.
+    np.testing.assert_array_equal(b["section_means"], [7, 5])
+    np.testing.assert_array_equal(b["section_percentiles"][25], [6, 4])
+    np.testing.assert_array_equal(b["section_percentiles"][50], [7, 5])
+    np.testing.assert_array_equal(b["section_percentiles"][75], [8, 6])
+    assert np.isclose(b["overall_mean"], 24 / 7)
+
+
+def test_summarize_smaller_scale():
+    """With a 1..4 scale the 5s count as out of range as well."""
+    a, b = summarize(table(), scale=4)
+
+    np.testing.assert_array_equal(b["out_of_range"], [[1, 0], [1, 0]])
+    np.testing.assert_array_equal(b["question_means"], [[1, 4], [3, 2]])
+    assert b["distribution"].shape == (2, 2, 4)
+    assert np.isclose(b["overall_mean"], 14 / 5)
+
+
+def test_summarize_empty():
+    empty = ScoreTable(np.full((0, 0, 0), nan), np.array([], dtype=object), [],
+                       np.array([], dtype=np.int64), scale=5)
+    assert summarize(empty) == []
+
+
+def test_load_table(tmp_path):
+    """Stored sheets become the dense array; unanswered rows stay NaN."""
+    store = ResultStore(str(tmp_path / "results.db"))
+    store.add_sheets([
+        ({"Section 1": {"row_scores": {1: 5, 2: 4}, "total_score": 9, "total_columns": 5}},
+         "a.jpg", "Dr. B", "2025-1", "ter-v1"),
+        ({"Section 1": {"row_scores": {2: 3}, "total_score": 3, "total_columns": 5}},
+         "b.jpg", None, "2025-1", "ter-v1"),
+    ])
+
+    loaded = load_table(store, form="ter-v1")
+    store.close()
+    assert loaded.sections == ["Section 1"]
+    assert loaded.faculty.tolist() == ["Dr. B", UNASSIGNED]
+    np.testing.assert_array_equal(loaded.scores, [[[5, 4]], [[nan, 3]]])
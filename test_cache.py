@@ -0,0 +1,94 @@
+import os
+import shutil
+
+import pytest
+
+import cache
+from cache import PIPELINE_MODULES, ResultCache, image_key
+from profiles import DEFAULT_PARAMS, fingerprint, merge_params
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SCAN = os.path.join(BASE_DIR, "scan2.jpg")
+SECTIONS = {"Section 1": {"row_scores": {1: 4, 2: 3}, "total_score": 7, "total_columns": 5,
+                          "confidence": {1: 0.9, 2: 0.45}}}
+
+
+@pytest.fixture
+def pipeline_copy(tmp_path, monkeypatch):
+    """A copy of the pipeline sources that cache.py hashes instead of the real ones."""
+    for name in PIPELINE_MODULES:
+        shutil.copy(os.path.join(BASE_DIR, name), tmp_path / name)
+    shutil.copytree(os.path.join(BASE_DIR, cache.FORMS_DIR), tmp_path / cache.FORMS_DIR)
+    monkeypatch.setattr(cache, "__file__", str(tmp_path / "cache.py"))
+    cache.pipeline_fingerprint.cache_clear()
+    yield tmp_path
+    cache.pipeline_fingerprint.cache_clear()
+
+
+def test_key_follows_pipeline_code(pipeline_copy):
+    """Editing a pipeline module or a form definition gives the image a new key."""
+    before = image_key(SCAN)
+    assert image_key(SCAN) == before
+
+    with open(pipeline_copy / "utils.py", "a", encoding="utf-8") as f:
+        f.write("\n# tuned\n")
+    cache.pipeline_fingerprint.cache_clear()
+    after_code = image_key(SCAN)
+    assert after_code != before
+
+    form_path = pipeline_copy / cache.FORMS_DIR / os.listdir(pipeline_copy / cache.FORMS_DIR)[0]
+    with open(form_path, "a", encoding="utf-8") as f:
+        f.write("\n")
+    cache.pipeline_fingerprint.cache_clear()
+    assert image_key(SCAN) not in (before, after_code)
+
+
+def test_key_follows_parameters():
+    """Another profile, form or layout file is another key."""
+    profile = fingerprint(DEFAULT_PARAMS)
+    tuned = fingerprint(merge_params(DEFAULT_PARAMS, {"vertical": {"threshold": 15}}))
+    key = image_key(SCAN, profile=profile, form=None, layout=None)
+
+    assert image_key(SCAN, profile=profile, form=None, layout=None) == key
+    assert image_key(SCAN, profile=tuned, form=None, layout=None) != key
+    assert image_key(SCAN, profile=profile, form="ter-v1", layout=None) != key
+    assert image_key(SCAN, profile=profile, form=None, layout="abc") != key
+
+
+def test_get_put(tmp_path):
+    """Entries come back with integer row numbers and their form; misses give (None, None)."""
+    results = ResultCache(str(tmp_path))
+    results.put("k", SECTIONS, "ter-v1")
+
+    assert results.get("k") == (SECTIONS, "ter-v1")
+    assert results.get("missing") == (None, None)
+
+
+def test_evict_least_recently_used(tmp_path):
+    """Eviction drops the oldest entries first; a hit makes an entry young again."""
+    results = ResultCache(str(tmp_path))
+    for age, key in enumerate(("c", "b", "a")):
+        results.put(key, SECTIONS)
+        os.utime(tmp_path / f"{key}.json", (1000 - age * 100,) * 2)
+    # "a" is the oldest, but reading it makes it the most recent.
+    results.get("a")
+
+    size = os.path.getsize(tmp_path / "a.json")
+    results.max_bytes = 2 * size
+    results.evict()
+    assert sorted(os.listdir(tmp_path)) == ["a.json", "c.json"]
+
+    results.max_bytes = 3 * size
+    results.evict()
+    assert sorted(os.listdir(tmp_path)) == ["a.json", "c.json"]
+
+
+def test_put_evicts_every_few_writes(tmp_path, monkeypatch):
+    """put runs the size check every EVICT_EVERY writes."""
+    monkeypatch.setattr(cache, "EVICT_EVERY", 3)
+    results = ResultCache(str(tmp_path), max_bytes=0)
+    results.put("a", SECTIONS)
+    results.put("b", SECTIONS)
+    assert len(os.listdir(tmp_path)) == 2
+    results.put("c", SECTIONS)
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,36 @@
+import os
+
+import pytest
+
+from bench import build_corpus
+from loader import load_scan
+from main import process_sections, section_errors
+
+SCAN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scan2.jpg")
+
+# The marks on scan2.jpg, read by hand: section -> score of every row.
+EXPECTED = {
+    "Section 1": [4, 3, 4, 4, 4],
+    "Section 2": [5, 4, 4, 4, 3],
+    "Section 3": [2, 3, 4, 4, 4],
+    "Section 4": [4, 4, 4, 3, 4],
+}
+
+
+@pytest.mark.parametrize("angle", [-5, -4, -3, -2, -1, 0, 1, 2, 3, 4, 5])
+@pytest.mark.parametrize("scale", [1.0, 0.5, 0.25])
+@pytest.mark.parametrize("table, grid", [(True, None), (False, "hough"), (False, "projection")],
+                         ids=["table", "hough", "projection"])
+def test_rotated_scan(tmp_path, table, grid, scale, angle):
+    """
+    A turned copy of scan2.jpg scores the same as the sheet itself, read as
+    a whole table and with each per-section grid finder (the fallback when
+    the table does not split).
+    """
+    path, = build_corpus(SCAN, str(tmp_path), scales=(scale,), rotations=(angle,))
+    results = process_sections(load_scan(path), table=table, grid=grid)
+
+    assert section_errors(results) == []
+    scores = {name: [data["row_scores"][row] for row in sorted(data["row_scores"])]
+              for name, data in results.items()}
+    assert scores == EXPECTED
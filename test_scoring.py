@@ -0,0 +1,148 @@
+import numpy as np
+import pytest
+
+from scoring import assign_cells, cell_fill_ratios, fill_marks, pick_marks
+
+Y_COORDS = [0, 20, 40, 60]
+X_COORDS = [0, 30, 60, 90, 120]
+
+
+def loop_assign_cells(circles, y_coords, x_coords):
+    """The per-circle, per-cell loops assign_cells replaced."""
+    n_rows, n_cols = len(y_coords) - 1, len(x_coords) - 1
+    answers = np.zeros((n_rows, n_cols), dtype=np.uint8)
+    taken = {}
+    unassigned = []
+    for x, y, r in circles:
+        for i in range(n_rows):
+            for j in range(n_cols):
+                if y_coords[i] <= y < y_coords[i + 1] and x_coords[j] <= x < x_coords[j + 1]:
+                    taken.setdefault((i + 1, j + 1), (x, y, r))
+                    answers[i, j] = 1
+                    break
+            else:
+                continue
+            break
+        else:
+            unassigned.append((x, y))
+    cells = [(row, col, x, y, r) for (row, col), (x, y, r) in sorted(taken.items())]
+    return cells, unassigned, answers
+
+
+def loop_fill_ratios(binary, y_coords, x_coords, inset=0.1):
+    """Ink fraction of every cell, one slice at a time."""
+    ratios = np.zeros((len(y_coords) - 1, len(x_coords) - 1))
+    for i in range(len(y_coords) - 1):
+        for j in range(len(x_coords) - 1):
+            dy = int((y_coords[i + 1] - y_coords[i]) * inset)
+            dx = int((x_coords[j + 1] - x_coords[j]) * inset)
+            cell = binary[y_coords[i] + dy:y_coords[i + 1] - dy,
+                          x_coords[j] + dx:x_coords[j + 1] - dx]
+            ratios[i, j] = (cell > 0).mean() if cell.size else 0.0
+    return ratios
+
+
+def test_assign_cells_bins_by_cell():
+    """Circles land in the cell their centre is in; rules belong to the cell after them."""
+    circles = [(15, 10, 5), (30, 25, 5), (119, 59, 5), (200, 10, 5), (10, -1, 5)]
+    cells, unassigned, answers = assign_cells(circles, Y_COORDS, X_COORDS)
+
+    assert cells == [(1, 1, 15, 10, 5), (2, 2, 30, 25, 5), (3, 4, 119, 59, 5)]
+    assert unassigned == [(200, 10), (10, -1)]
+    assert answers.tolist() == [[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 0, 1]]
+
+
+def test_assign_cells_keeps_first_circle_of_a_cell():
+    """Of two circles in one cell only the first detected is kept."""
+    cells, unassigned, answers = assign_cells([(40, 50, 6), (45, 45, 9)], Y_COORDS, X_COORDS)
+
+    assert cells == [(3, 2, 40, 50, 6)]
+    assert unassigned == []
+    assert answers.sum() == 1
+
+
+def test_assign_cells_without_circles_or_grid():
+    """No circles gives an empty answer matrix; no grid leaves every circle unassigned."""
+    cells, unassigned, answers = assign_cells([], Y_COORDS, X_COORDS)
+    assert (cells, unassigned, answers.shape) == ([], [], (3, 4))
+
+    cells, unassigned, answers = assign_cells([(5, 5, 3)], [10], [])
+    assert (cells, unassigned, answers.shape) == ([], [(5, 5)], (0, 0))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_assign_cells_matches_loops(seed):
+    """Random grids and circles (also outside and on the rules) give what the loops give."""
+    rng = np.random.default_rng(seed)
+    y_coords = np.cumsum(rng.integers(5, 40, size=rng.integers(1, 8))).tolist()
+    x_coords = np.cumsum(rng.integers(5, 40, size=rng.integers(1, 8))).tolist()
+    circles = [(int(x), int(y), int(r)) for x, y, r in
+               zip(rng.integers(-10, max(x_coords) + 10, size=30),
+                   rng.integers(-10, max(y_coords) + 10, size=30),
+                   rng.integers(3, 12, size=30))]
+    # Some centres exactly on the rules.
+    circles += [(x_coords[0], y_coords[-1], 4), (x_coords[-1], y_coords[0], 4)]
+
+    cells, unassigned, answers = assign_cells(circles, y_coords, x_coords)
+    expected_cells, expected_unassigned, expected_answers = loop_assign_cells(
+        circles, y_coords, x_coords)
+
+    assert cells == expected_cells
+    assert unassigned == expected_unassigned
+    assert np.array_equal(answers, expected_answers)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_cell_fill_ratios_match_loops(seed):
+    """The integral-image ratios equal the ink fraction of every inset cell."""
+    rng = np.random.default_rng(seed)
+    binary = (rng.random((100, 150)) < 0.3).astype(np.uint8) * 255
+    y_coords = np.sort(rng.choice(np.arange(100), size=5, replace=False)).tolist()
+    x_coords = np.sort(rng.choice(np.arange(150), size=6, replace=False)).tolist()
+
+    ratios = cell_fill_ratios(binary, y_coords, x_coords)
+
+    assert ratios.shape == (4, 5)
+    assert np.allclose(ratios, loop_fill_ratios(binary, y_coords, x_coords))
+
+
+def test_cell_fill_ratios_without_cells():
+    """Fewer than two lines on an axis gives no cells on it."""
+    binary = np.zeros((50, 50), dtype=np.uint8)
+    assert cell_fill_ratios(binary, [10], [0, 20, 40]).shape == (0, 2)
+    assert cell_fill_ratios(binary, [], []).shape == (0, 0)
+
+
+def test_pick_marks():
+    """The darkest cell wins when it stands out enough; empty or tied rows get -1."""
+    ratios = np.array([
+        [0.1, 0.6, 0.1],    # clear mark
+        [0.0, 0.0, 0.0],    # empty
+        [0.5, 0.45, 0.1],   # too close to call
+        [0.0, 0.0, 0.3],
+    ])
+    columns, confidence = pick_marks(ratios)
+
+    assert columns.tolist() == [1, -1, -1, 2]
+    assert np.allclose(confidence, [0.5 / 0.6, 0.0, 0.1, 1.0])
+
+
+def test_pick_marks_edge_shapes():
+    """A single column is always confident when inked; no cells gives no marks."""
+    columns, confidence = pick_marks(np.array([[0.4], [0.0]]))
+    assert columns.tolist() == [0, -1]
+    assert confidence.tolist() == [1.0, 0.0]
+
+    columns, confidence = pick_marks(np.zeros((2, 0)))
+    assert columns.tolist() == [-1, -1]
+
+
+def test_fill_marks_centres_the_marked_cells():
+    """A filled cell becomes a circle at its centre; a blank row gets none."""
+    binary = np.zeros((60, 120), dtype=np.uint8)
+    binary[2:18, 62:88] = 255     # row 1, column 3
+    binary[42:58, 2:28] = 255     # row 3, column 1
+    circles, confidence = fill_marks(binary, Y_COORDS, X_COORDS)
+
+    assert circles == [(75, 10, 10), (15, 50, 10)]
+    assert confidence == {1: 1.0, 2: 0.0, 3: 1.0}
@@ -0,0 +1,89 @@
+import sqlite3
+
+from store import ResultStore
+from template import DEFAULT_FORM
+
+SHEET = {
+    "Section 1": {"row_scores": {1: 4, 2: 3}, "total_score": 7, "total_columns": 5,
+                  "confidence": {1: 0.9, 2: 0.45}},
+    "Section 2": {"row_scores": {1: 5}, "total_score": 5, "total_columns": 5},
+}
+
+
+def test_round_trip(tmp_path):
+    """A stored sheet loads back with its info, totals and row scores."""
+    store = ResultStore(str(tmp_path / "results.db"))
+    first, second = store.add_sheets([
+        (SHEET, "a.jpg", "Dr. A", "2025-1", DEFAULT_FORM),
+        (SHEET, "b.jpg", "Dr. B", "2025-2", "ter-v2"),
+    ])
+
+    info, results = store.load_sheet(first)
+    assert {key: info[key] for key in ("path", "faculty", "term", "form", "total_score")} == {
+        "path": "a.jpg", "faculty": "Dr. A", "term": "2025-1", "form": DEFAULT_FORM,
+        "total_score": 12}
+    assert results == {name: {key: data[key] for key in ("row_scores", "total_score",
+                                                         "total_columns")}
+                       for name, data in SHEET.items()}
+    confidence = store.conn.execute(
+        "SELECT row, confidence FROM row_scores WHERE sheet_id = ? AND section = 'Section 1' "
+        "ORDER BY row", (first,)).fetchall()
+    assert confidence == [(1, 0.9), (2, 0.45)]
+
+    assert store.latest_sheet_id() == second
+    assert store.load_sheet(second + 1) is None
+    store.close()
+
+
+def test_filters(tmp_path):
+    """Sheets and scores can be narrowed to one faculty, term or form."""
+    store = ResultStore(str(tmp_path / "results.db"))
+    first, second = store.add_sheets([
+        (SHEET, "a.jpg", "Dr. A", "2025-1", DEFAULT_FORM),
+        (SHEET, "b.jpg", "Dr. B", "2025-2", "ter-v2"),
+    ])
+
+    assert store.count_sheets() == 2
+    assert store.sheets(faculty="Dr. B") == [(second, "Dr. B")]
+    assert store.count_sheets(term="2025-1") == 1
+    assert store.forms() == sorted([DEFAULT_FORM, "ter-v2"])
+    assert store.forms(faculty="Dr. A") == [DEFAULT_FORM]
+
+    scores = store.section_row_scores(form="ter-v2")
+    assert scores["Section 1"] == [(second, 1, 4), (second, 2, 3)]
+    assert scores["Section 2"] == [(second, 1, 5)]
+    assert len(store.section_row_scores()["Section 1"]) == 4
+    store.close()
+
+
+def test_migrate_adds_form(tmp_path):
+    """A database from before form templates gets a form column, set to the TER form."""
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE sheets (
+            id          INTEGER PRIMARY KEY,
+            path        TEXT,
+            faculty     TEXT,
+            term        TEXT,
+            scanned_at  REAL NOT NULL,
+            total_score INTEGER NOT NULL
+        );
+        INSERT INTO sheets (path, faculty, term, scanned_at, total_score)
+        VALUES ('old.jpg', 'Dr. A', '2024-2', 0, 12);
+    """)
+    conn.close()
+
+    store = ResultStore(path)
+    info, results = store.load_sheet(1)
+    assert info["path"] == "old.jpg"
+    assert info["form"] == DEFAULT_FORM
+    assert results == {}
+
+    # New sheets go in next to the old ones; opening it again changes nothing.
+    new_id = store.add_sheet(SHEET, "new.jpg", "Dr. A", "2025-1", "ter-v2")
+    store.close()
+    store = ResultStore(path)
+    assert store.forms() == sorted([DEFAULT_FORM, "ter-v2"])
+    assert store.load_sheet(new_id)[1]["Section 2"]["row_scores"] == {1: 5}
+    store.close()
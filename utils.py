@@ -1,20 +1,87 @@
 import cv2
 import numpy as np
+import instrument
+from profiles import DEFAULT_PARAMS
 
-def detect_circles(section_img, section_name="Section"):
-    gray = cv2.cvtColor(section_img, cv2.COLOR_BGR2GRAY)
-    blurred = cv2.GaussianBlur(gray, (3, 3), 1)
+class Planes(dict):
+    """
+    The grayscale, blurred and binarized planes the detectors below work
+    on, as a dict that computes each plane the first time it is looked up
+    (most sheets only ever need "binary"). A plane of a crop (crop_planes)
+    is a view of the same plane of the whole image, so every section is
+    binarized with the threshold of the whole area. Sections scored on
+    threads may both compute a plane that is not there yet; they get the
+    same pixels either way.
+    """
+
+    def __init__(self, img=None, parent=None, region=None):
+        super().__init__()
+        self.img = img
+        self.parent = parent
+        self.region = region
+
+    def __missing__(self, name):
+        if self.parent is not None:
+            plane = self.parent[name][self.region]
+        elif name == "gray":
+            plane = cv2.cvtColor(self.img, cv2.COLOR_BGR2GRAY)
+        elif name == "blurred":
+            plane = cv2.GaussianBlur(self["gray"], (3, 3), 1)
+        elif name == "binary":
+            # Binarize with the lines white (inverted)
+            _, plane = cv2.threshold(cv2.bitwise_not(self["gray"]), 0, 255,
+                                     cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+        elif name == "binary_blurred":
+            # Same with a little smoothing first
+            smoothed = cv2.bitwise_not(cv2.GaussianBlur(self["gray"], (3, 3), 0))
+            _, plane = cv2.threshold(smoothed, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+        else:
+            raise KeyError(name)
+        self[name] = plane
+        return plane
+
+def preprocess(img):
+    """
+    The planes the detectors below work on, computed from img as they are
+    first used (see Planes). Looks like a dict of planes, all the same size
+    as img:
+      - "gray": grayscale image
+      - "blurred": Gaussian blur used by detect_circles
+      - "binary": inverted Otsu binarization used by detect_vertical_lines
+      - "binary_blurred": same on a lightly blurred image, used by detect_horizontal_lines
+    """
+    return Planes(img)
+
+def crop_planes(planes, y0, y1, x0, x1):
+    """Zero-copy views of the same region of every plane from preprocess()."""
+    return Planes(parent=planes, region=(slice(y0, y1), slice(x0, x1)))
 
-    #pls dont fucking touch this
+@instrument.timed("detect_circles", tags=("section_name",))
+def detect_circles(section_img, section_name="Section", planes=None, draw=True, params=None):
+    """
+    Find the encircled answers of a section with HoughCircles.
+    params: scanner profile (profiles.py) to take the HoughCircles settings
+    from; the default profile when None.
+    Returns a copy of the section with the circles drawn (None when draw is
+    False) and the list of circles as (x, y, r). section_img is not modified.
+    """
+    if planes is not None:
+        blurred = planes["blurred"]
+    else:
+        gray = cv2.cvtColor(section_img, cv2.COLOR_BGR2GRAY)
+        blurred = cv2.GaussianBlur(gray, (3, 3), 1)
+
+    # Tune these per scanner in profiles.json (see calibrate.py), not here.
+    settings = (params or DEFAULT_PARAMS)["circles"]
     circles = cv2.HoughCircles(
         blurred, 
         cv2.HOUGH_GRADIENT, 
-        dp=1.5, 
-        param1=100, 
-        minDist=10,
-        param2=30,
-        minRadius=5,
-        maxRadius=14
+        dp=settings["dp"], 
+        param1=settings["param1"], 
+        minDist=settings["min_dist"],
+        param2=settings["param2"],
+        minRadius=settings["min_radius"],
+        maxRadius=settings["max_radius"]
     )
 
     detected = []
@@ -23,42 +90,58 @@ def detect_circles(section_img, section_name="Section"):
     if circles is not None:
         circles = np.uint16(np.around(circles))
         for x, y, r in circles[0, :]:
-            cv2.circle(section_img, (x, y), r, (0, 255, 0), 1)
-            cv2.circle(section_img, (x, y), 2, (0, 255, 0), 3)
-            
             detected.append((x, y, r))
-    else:
-        print("No circles detected.")
 
-    return section_img, detected
+    output = draw_circles(section_img.copy(), detected) if draw else None
+    instrument.count("circles_found", len(detected), section=section_name)
+    return output, detected
+
+def draw_circles(img, circles):
+    """Draw circles given as (x, y, r) onto img (in place) and return it."""
+    for x, y, r in circles:
+        cv2.circle(img, (int(x), int(y)), int(r), (0, 255, 0), 1)
+        cv2.circle(img, (int(x), int(y)), 2, (0, 255, 0), 3)
+    return img
 
-def detect_vertical_lines(section_img, section_name="Section"):
+@instrument.timed("detect_vertical_lines", tags=("section_name",))
+def detect_vertical_lines(section_img, section_name="Section", planes=None, draw=True,
+                          params=None):
     """
     Process the section image to detect vertical lines.
     Returns the output image (with drawn lines), a list of filtered x-coordinates,
     and a list of column ranges (each as a tuple: (start_x, end_x)).
+    If planes (from preprocess/crop_planes) are given, their "binary" plane is
+    used instead of binarizing the section again.
+    With draw=False no output image is made (None is returned in its place).
+    params: scanner profile (profiles.py); the default profile when None.
     """
-    # Convert to grayscale
-    gray = cv2.cvtColor(section_img, cv2.COLOR_BGR2GRAY)
-    
-    # Invert to make lines white
-    gray = cv2.bitwise_not(gray)
-    
-    # Binarize image
-    _, binary = cv2.threshold(gray, 0, 255,
-                              cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    params = params or DEFAULT_PARAMS
+    settings = params["vertical"]
+    if planes is not None:
+        binary = planes["binary"]
+    else:
+        # Convert to grayscale
+        gray = cv2.cvtColor(section_img, cv2.COLOR_BGR2GRAY)
+        
+        # Invert to make lines white
+        gray = cv2.bitwise_not(gray)
+        
+        # Binarize image
+        _, binary = cv2.threshold(gray, 0, 255,
+                                  cv2.THRESH_BINARY | cv2.THRESH_OTSU)
     
     # Morphology to isolate vertical lines using a tall, narrow kernel
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, 15))
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, settings["kernel_height"]))
     vertical_lines = cv2.morphologyEx(binary, cv2.MORPH_OPEN, kernel)
     
     # Hough Transform to detect vertical line segments 
-    # pls dont fucking touch this
     lines = cv2.HoughLinesP(vertical_lines, 1, np.pi / 180,
-                            threshold=6, minLineLength=20, maxLineGap=300)
+                            threshold=settings["threshold"],
+                            minLineLength=settings["min_line_length"],
+                            maxLineGap=settings["max_line_gap"])
     
     # Copy the section image to draw the lines on
-    output = section_img.copy()
+    output = section_img.copy() if draw else None
     x_coords_raw = []
     
     # If any lines are detected, process them
@@ -66,30 +149,32 @@ def detect_vertical_lines(section_img, section_name="Section"):
         for x1, y1, x2, y2 in lines[:, 0]:
             angle = abs(np.degrees(np.arctan2(y2 - y1, x2 - x1)))
             if angle > 85:  # near vertical
-                cv2.line(output, (x1, y1), (x2, y2), (0, 255, 0), 2)
+                if draw:
+                    cv2.line(output, (x1, y1), (x2, y2), (0, 255, 0), 2)
                 x_avg = (x1 + x2) // 2
                 x_coords_raw.append(x_avg)
     
     # Sort the x-coordinates and filter duplicates (close ones)
     x_coords_raw.sort()
     x_coords_filtered = []
-    duplicate_threshold = 10  # pixel gap between unique lines
+    duplicate_threshold = params["merge_distance"]  # pixel gap between unique lines
     
     for x in x_coords_raw:
         if not x_coords_filtered or abs(x - x_coords_filtered[-1]) > duplicate_threshold:
             x_coords_filtered.append(x)
     
     # Optionally, draw the filtered vertical lines on the image and print their positions
-    for x in x_coords_filtered:
-        cv2.line(output, (x, 0), (x, output.shape[0]), (0, 255, 0), 2)
+    if draw:
+        for x in x_coords_filtered:
+            cv2.line(output, (x, 0), (x, output.shape[0]), (0, 255, 0), 2)
         
     
-   
-    
-    
+    instrument.count("lines_vertical", len(x_coords_filtered), section=section_name)
     return output, x_coords_filtered
 
-def detect_horizontal_lines(section_img, section_name="Section"):
+@instrument.timed("detect_horizontal_lines", tags=("section_name",))
+def detect_horizontal_lines(section_img, section_name="Section", planes=None, draw=True,
+                            params=None):
     """
     Detect horizontal lines in the given section image.
     Returns:
@@ -97,38 +182,46 @@ def detect_horizontal_lines(section_img, section_name="Section"):
       - y_coords_filtered: a list of the filtered y-coordinates for the detected lines,
       - rows: a list of tuples representing the y range for each row.
               For example, if there are 6 horizontal lines detected, there will be 5 row ranges.
+    If planes (from preprocess/crop_planes) are given, their "binary_blurred"
+    plane is used instead of binarizing the section again.
+    With draw=False no output image is made (None is returned in its place).
+    params: scanner profile (profiles.py); the default profile when None.
     """
-    # Convert image to grayscale
-    gray = cv2.cvtColor(section_img, cv2.COLOR_BGR2GRAY)
-    
-    # Optional: smooth the image
-    gray = cv2.GaussianBlur(gray, (3, 3), 0)
-    
-    # Invert so lines become white
-    gray = cv2.bitwise_not(gray)
-    
-    # Binarize the image
-    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    params = params or DEFAULT_PARAMS
+    settings = params["horizontal"]
+    if planes is not None:
+        binary = planes["binary_blurred"]
+    else:
+        # Convert image to grayscale
+        gray = cv2.cvtColor(section_img, cv2.COLOR_BGR2GRAY)
+        
+        # Optional: smooth the image
+        gray = cv2.GaussianBlur(gray, (3, 3), 0)
+        
+        # Invert so lines become white
+        gray = cv2.bitwise_not(gray)
+        
+        # Binarize the image
+        _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
     
     # Morphology to isolate horizontal lines:
     # Use a wide kernel to connect across bubbles
-    # pls dont fucking touch this
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (40, 1))
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (settings["kernel_width"], 1))
     horizontal_lines = cv2.morphologyEx(binary, cv2.MORPH_OPEN, kernel)
     horizontal_lines = cv2.morphologyEx(horizontal_lines, cv2.MORPH_CLOSE, kernel)
     
     # Additional bridging to further connect broken parts
-    # pls dont fucking touch this
-    bridge_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (10, 1))
+    bridge_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (settings["bridge_width"], 1))
     horizontal_lines = cv2.dilate(horizontal_lines, bridge_kernel, iterations=1)
     
     # Hough Transform to detect horizontal line segments
-    # pls dont fucking touch this
-    lines = cv2.HoughLinesP(horizontal_lines, 1.5, np.pi / 180,
-                            threshold=30, minLineLength=8, maxLineGap=1000)
+    lines = cv2.HoughLinesP(horizontal_lines, settings["rho"], np.pi / 180,
+                            threshold=settings["threshold"],
+                            minLineLength=settings["min_line_length"],
+                            maxLineGap=settings["max_line_gap"])
     
     # Create a copy to draw lines on
-    output = section_img.copy()
+    output = section_img.copy() if draw else None
     y_coords_raw = []
     
     # Loop over detected lines and keep those that are near-horizontal
@@ -138,7 +231,8 @@ def detect_horizontal_lines(section_img, section_name="Section"):
             angle = abs(np.degrees(np.arctan2(y2 - y1, x2 - x1)))
             if angle < 5:  # near horizontal
                 # Draw the detected line
-                cv2.line(output, (x1, y1), (x2, y2), (0, 255, 0), 2)
+                if draw:
+                    cv2.line(output, (x1, y1), (x2, y2), (0, 255, 0), 2)
                 # Get the average y coordinate of the line
                 y_avg = (y1 + y2) // 2
                 y_coords_raw.append(y_avg)
@@ -146,19 +240,197 @@ def detect_horizontal_lines(section_img, section_name="Section"):
     # Filter duplicate/close y-coordinates
     y_coords_raw.sort()
     y_coords_filtered = []
-    duplicate_threshold = 10  # pixels
+    duplicate_threshold = params["merge_distance"]  # pixels
     
     for y in y_coords_raw:
         if not y_coords_filtered or abs(y - y_coords_filtered[-1]) > duplicate_threshold:
             y_coords_filtered.append(y)
     
     # Optionally, draw the filtered horizontal lines (full width) and print their y positions
-    for y in y_coords_filtered:
-        cv2.line(output, (0, y), (output.shape[1], y), (0, 255, 0), 2)
+    if draw:
+        for y in y_coords_filtered:
+            cv2.line(output, (0, y), (output.shape[1], y), (0, 255, 0), 2)
         
     
     # Calculate row ranges based on filtered y-coordinates.
     # For example, if there are 6 horizontal lines, you get 5 row ranges.
     
     
-    return output, y_coords_filtered
\ No newline at end of file
+    instrument.count("lines_horizontal", len(y_coords_filtered), section=section_name)
+    return output, y_coords_filtered
+
+def profile_peaks(profile, min_coverage, merge_distance):
+    """
+    Positions of the rules in a 1-D ink profile (fraction of ink per pixel
+    row or column): every run of positions at or above min_coverage, with
+    runs closer than merge_distance merged, gives its strongest position.
+    """
+    idx = np.flatnonzero(profile >= min_coverage)
+    if len(idx) == 0:
+        return []
+    starts = np.r_[0, np.flatnonzero(np.diff(idx) > merge_distance) + 1]
+    ends = np.r_[starts[1:], len(idx)]
+    return [int(idx[s + np.argmax(profile[idx[s:e]])]) for s, e in zip(starts, ends)]
+
+def rule_masks(binary, length):
+    """
+    The horizontal and the vertical rules of a binarized image: openings
+    with a length x 1 and a 1 x length line kernel, which drop every ink
+    stroke shorter than length (marks, text).
+    """
+    horizontal = cv2.morphologyEx(binary, cv2.MORPH_OPEN,
+                                  cv2.getStructuringElement(cv2.MORPH_RECT, (length, 1)))
+    vertical = cv2.morphologyEx(binary, cv2.MORPH_OPEN,
+                                cv2.getStructuringElement(cv2.MORPH_RECT, (1, length)))
+    return horizontal, vertical
+
+@instrument.timed("detect_grid_projection", tags=("section_name",))
+def detect_grid_projection(section_img, section_name="Section", planes=None, draw=True,
+                           params=None):
+    """
+    Find the row and column rules of an axis-aligned table from the ink
+    profiles of the binarized section: after an opening with a horizontal
+    and a vertical line kernel (which drops the marks and text), one sum
+    over the pixel rows and one over the pixel columns, then peak finding
+    on the two 1-D profiles (see profile_peaks; row rules too faint for it
+    are filled in by find_faint_rules). A fast alternative to
+    detect_horizontal_lines plus detect_vertical_lines for aligned sheets.
+    Returns the output image with the rules drawn (None when draw is False),
+    the y-coordinates of the row rules and the x-coordinates of the column
+    rules, in the same form as the line detectors.
+    """
+    params = params or DEFAULT_PARAMS
+    if planes is not None:
+        binary = planes["binary"]
+    else:
+        gray = cv2.cvtColor(section_img, cv2.COLOR_BGR2GRAY)
+        _, binary = cv2.threshold(cv2.bitwise_not(gray), 0, 255,
+                                  cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+
+    settings = params["projection"]
+    horizontal, vertical = rule_masks(binary, settings["min_rule_length"])
+
+    height, width = binary.shape[:2]
+    rows = np.count_nonzero(horizontal, axis=1) / width
+    columns = np.count_nonzero(vertical, axis=0) / height
+    y_coords = profile_peaks(rows, settings["min_coverage"], params["merge_distance"])
+    y_coords = find_faint_rules(y_coords, rows, settings["faint_coverage"], settings["faint_gap"])
+    x_coords = profile_peaks(columns, settings["min_coverage"], params["merge_distance"])
+
+    output = None
+    if draw:
+        output = section_img.copy()
+        for y in y_coords:
+            cv2.line(output, (0, y), (width, y), (0, 255, 0), 2)
+        for x in x_coords:
+            cv2.line(output, (x, 0), (x, height), (0, 255, 0), 2)
+
+    instrument.count("lines_horizontal", len(y_coords), section=section_name)
+    instrument.count("lines_vertical", len(x_coords), section=section_name)
+    return output, y_coords, x_coords
+
+def find_faint_rules(y_coords, rows, min_coverage, min_gap):
+    """
+    Fill in the row rules of a section that were too faint to be found: a
+    band at least min_gap times as tall as the section's typical row is two
+    rows whose rule in between broke up (a thin rule on a skewed or soft
+    scan). The strongest pixel row in the middle of such a band is taken as
+    the rule when at least min_coverage of it is ink.
+
+    Input:
+      y_coords: the row rules of the section, top to bottom.
+      rows: fraction of horizontal-rule ink on every pixel row.
+
+    Returns:
+      y_coords with the rules that were found added.
+    """
+    if len(y_coords) < 3:
+        return y_coords
+    row_height = np.median(np.diff(y_coords))
+    filled = [y_coords[0]]
+    for y0, y1 in zip(y_coords, y_coords[1:]):
+        if y1 - y0 >= min_gap * row_height:
+            lo = int(y0 + row_height / 2)
+            hi = int(y1 - row_height / 2)
+            y = lo + int(np.argmax(rows[lo:hi + 1]))
+            if rows[y] >= min_coverage:
+                filled.append(y)
+                instrument.count("faint_rules")
+        filled.append(y1)
+    return filled
+
+@instrument.timed("detect_table_grid")
+def detect_table_grid(table_img, planes=None, params=None):
+    """
+    Find the grids of all sections of the answer table at once.
+
+    The rules are found as in detect_grid_projection, but over the whole
+    table: every row rule in one pass, and the column rules (shared by all
+    sections) once. The bands between two row rules that the column rules
+    run through are answer rows; header and "Score" rows span the whole
+    table without them. Every run of answer rows is one section. As the
+    columns of a scanned page can drift a few pixels from one section to
+    the next, each section snaps the shared columns to its own rules.
+    
+    Returns:
+      a list with the (y_coords, x_coords) of every section, top to
+      bottom, in table coordinates.
+    """
+    params = params or DEFAULT_PARAMS
+    if planes is not None:
+        binary = planes["binary"]
+    else:
+        gray = cv2.cvtColor(table_img, cv2.COLOR_BGR2GRAY)
+        _, binary = cv2.threshold(cv2.bitwise_not(gray), 0, 255,
+                                  cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+
+    settings = params["projection"]
+    horizontal, vertical = rule_masks(binary, settings["min_rule_length"])
+    height, width = binary.shape[:2]
+    min_coverage = settings["min_coverage"]
+    merge_distance = params["merge_distance"]
+
+    # Every row rule of the table.
+    rows = np.count_nonzero(horizontal, axis=1) / width
+    y_rules = profile_peaks(rows, min_coverage, merge_distance)
+    # The column rules, summed over a few pixel columns since those of the
+    # different sections are not exactly under each other.
+    drift = settings["column_drift"]
+    columns = np.count_nonzero(vertical, axis=0) / height
+    columns = np.convolve(columns, np.ones(2 * drift + 1), mode="same")
+    x_rules = profile_peaks(columns, min_coverage, merge_distance)
+    instrument.count("lines_horizontal", len(y_rules), section="Table")
+    instrument.count("lines_vertical", len(x_rules), section="Table")
+    if len(y_rules) < 2 or len(x_rules) < 3:
+        return []
+
+    # Fraction of the inner column rules present on every pixel row, then
+    # averaged over every band between two row rules. x_rules is the middle
+    # of each rule's drift, so the top and bottom sections can have their
+    # rule up to twice the drift away from it.
+    crossed = np.mean([vertical[:, max(x - 2 * drift, 0):x + 2 * drift + 1].any(axis=1)
+                       for x in x_rules[1:-1]], axis=0)
+    ys = np.asarray(y_rules)
+    cumulative = np.r_[0.0, np.cumsum(crossed)]
+    answer_rows = (cumulative[ys[1:]] - cumulative[ys[:-1]]) / np.maximum(np.diff(ys), 1) >= 0.5
+
+    sections = []
+    band = 0
+    while band < len(answer_rows):
+        if not answer_rows[band]:
+            band += 1
+            continue
+        first = band
+        while band < len(answer_rows) and answer_rows[band]:
+            band += 1
+        y_coords = find_faint_rules(y_rules[first:band + 1], rows, settings["faint_coverage"],
+                                    settings["faint_gap"])
+        # Snap every shared column to the strongest rule near it in this section.
+        profile = np.count_nonzero(vertical[y_coords[0]:y_coords[-1]], axis=0)
+        x_coords = []
+        for x in x_rules:
+            lo = max(x - drift, 0)
+            x_coords.append(int(lo + np.argmax(profile[lo:x + drift + 1])))
+        sections.append((y_coords, x_coords))
+    instrument.count("table_sections", len(sections))
+    return sections
@@ -0,0 +1,229 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from batch import IMAGE_EXTENSIONS, format_result, init_worker, score_path
+from cache import DEFAULT_CACHE_DIR
+from profiles import get_profile
+from template import get_template
+from store import DEFAULT_DB_PATH, ResultStore
+
+# Seconds between two looks at the watched folder.
+DEFAULT_INTERVAL = 1.0
+
+# A file is picked up once its size and modification time have not changed
+# for this many seconds (the scanner may still be writing it before that).
+DEFAULT_SETTLE = 2.0
+
+
+def log(message):
+    print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {message}", flush=True)
+
+
+def unique_destination(folder, name):
+    """Path in folder for name, with a number added if that name is taken."""
+    base, ext = os.path.splitext(name)
+    path = os.path.join(folder, name)
+    counter = 1
+    while os.path.exists(path):
+        path = os.path.join(folder, f"{base}-{counter}{ext}")
+        counter += 1
+    return path
+
+
+class FolderWatcher:
+    """
+    Scores every scan that lands in a folder, without anyone clicking Scan.
+
+    The folder is polled every interval seconds. A new file is only taken
+    once it has stopped growing for `settle` seconds, so half-written files
+    from the scanner or a network copy are left alone. Settled files are
+    scored on a process pool (batch.score_path: one result per sheet, or per
+    page of a TIFF/PDF). A file whose sheets all scored is moved to the done
+    folder and then stored in the results database under its new path; a
+    file with any failed sheet goes to the failed folder as a whole and
+    nothing of it is stored, so dropping it in again after a fix does not
+    store its good pages twice.
+    """
+
+    def __init__(self, inbox, executor, store, done_dir=None, failed_dir=None,
+                 settle=DEFAULT_SETTLE, faculty=None, term=None, output=None):
+        self.inbox = inbox
+        self.executor = executor
+        self.store = store
+        self.done_dir = done_dir or os.path.join(inbox, "done")
+        self.failed_dir = failed_dir or os.path.join(inbox, "failed")
+        self.settle = settle
+        self.faculty = faculty
+        self.term = term
+        self.output = output
+        self.seen = {}       # path -> ((size, mtime), time it was first seen like that)
+        self.in_flight = {}  # path -> future of batch.score_path
+        os.makedirs(self.done_dir, exist_ok=True)
+        os.makedirs(self.failed_dir, exist_ok=True)
+
+    def settled_files(self, now):
+        """Files in the inbox that have not changed for `settle` seconds."""
+        ready = []
+        current = set()
+        for entry in os.scandir(self.inbox):
+            if not entry.is_file() or not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            path = entry.path
+            current.add(path)
+            if path in self.in_flight:
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue  # Removed or renamed since scandir listed it.
+            signature = (stat.st_size, stat.st_mtime)
+            previous = self.seen.get(path)
+            if previous is None or previous[0] != signature:
+                # New or still being written: start (or restart) the clock.
+                self.seen[path] = (signature, now)
+            elif stat.st_size > 0 and now - previous[1] >= self.settle:
+                ready.append(path)
+
+        # Forget files that disappeared without being scored.
+        for path in set(self.seen) - current:
+            del self.seen[path]
+        return sorted(ready)
+
+    def poll(self, now=None):
+        """One round: queue newly settled files and finish the scored ones."""
+        now = time.monotonic() if now is None else now
+        for path in self.settled_files(now):
+            log(f"Queued {os.path.basename(path)}")
+            self.in_flight[path] = self.executor.submit(score_path, path)
+
+        for path, future in list(self.in_flight.items()):
+            if future.done():
+                del self.in_flight[path]
+                self.seen.pop(path, None)
+                self.finish(path, future)
+
+    def finish(self, path, future):
+        try:
+            results = future.result()
+        except Exception as e:
+            # The worker itself died (score_path reports sheet errors itself).
+            results = [{"path": path, "form": None, "sections": {}, "cached": False,
+                        "error": str(e)}]
+
+        ok = all(r["error"] is None for r in results)
+        folder = self.done_dir if ok else self.failed_dir
+        destination = unique_destination(folder, os.path.basename(path))
+        try:
+            shutil.move(path, destination)
+        except OSError as e:
+            # Still in the inbox, so it is scored (and stored) again later.
+            log(f"Could not move {path}: {e}")
+            ok = False
+        else:
+            # Sheets are known by where the file ends up (pages keep their
+            # "#page" suffix, see loader.page_name).
+            for result in results:
+                if result["path"].startswith(path):
+                    result["path"] = destination + result["path"][len(path):]
+
+        if ok:
+            self.store.add_sheets([(r["sections"], r["path"], self.faculty, self.term, r["form"])
+                                   for r in results])
+        if self.output is not None:
+            for result in results:
+                self.output.write(json.dumps(result) + "\n")
+            self.output.flush()
+        for result in results:
+            log(format_result(result))
+        if folder == self.failed_dir and any(r["error"] is None for r in results):
+            log(f"Nothing of {os.path.basename(path)} was stored; fix the failed sheet(s) "
+                f"and drop the file in again")
+
+    def idle(self):
+        return not self.in_flight
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Watch a folder and score every TER sheet the scanner drops into it."
+    )
+    parser.add_argument("inbox", help="folder the scanner writes to")
+    parser.add_argument("--done", help="where scored files are moved (default: <inbox>/done)")
+    parser.add_argument("--failed",
+                        help="where files that failed are moved (default: <inbox>/failed)")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH,
+                        help=f"results database (default: {DEFAULT_DB_PATH})")
+    parser.add_argument("-o", "--output", help="also append one JSON line per sheet to this file")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="number of worker processes (default: all cores)")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL,
+                        help=f"seconds between folder checks (default: {DEFAULT_INTERVAL})")
+    parser.add_argument("--settle", type=float, default=DEFAULT_SETTLE,
+                        help="seconds a file must stay unchanged before it is scored "
+                             f"(default: {DEFAULT_SETTLE})")
+    parser.add_argument("--faculty", help="faculty member the sheets are for")
+    parser.add_argument("--term", help="evaluation term, e.g. '2025-1'")
+    parser.add_argument("-l", "--layout",
+                        help="calibrated grid layout file (see layout.py); the sections "
+                             "are then read one by one, not as a whole table")
+    parser.add_argument("-p", "--profile",
+                        help="scanner profile from profiles.json (default: $TER_PROFILE "
+                             "or 'default')")
+    parser.add_argument("-f", "--form",
+                        help="score every sheet as this form (see template.py) instead of "
+                             "identifying the form of each sheet")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help=f"result cache folder (default: {DEFAULT_CACHE_DIR})")
+    parser.add_argument("--trace",
+                        help="append per-stage timings and counters as JSON lines to this file")
+    parser.add_argument("--once", action="store_true",
+                        help="score the files already in the folder, then exit")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.inbox):
+        print(f"{args.inbox} is not a folder.", file=sys.stderr)
+        return 1
+    try:
+        profile = get_profile(args.profile)
+        if args.form:
+            get_template(args.form)
+    except KeyError as e:
+        print(e.args[0], file=sys.stderr)
+        return 1
+
+    workers = args.workers or os.cpu_count()
+    store = ResultStore(args.db)
+    output = open(args.output, "a", encoding="utf-8") if args.output else None
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                   initargs=(args.layout, args.cache_dir, args.trace, False,
+                                             profile, args.form))
+    # With --once there is no point waiting for files to settle.
+    watcher = FolderWatcher(args.inbox, executor, store, args.done, args.failed,
+                            0.0 if args.once else args.settle, args.faculty, args.term, output)
+    log(f"Watching {os.path.abspath(args.inbox)} with {workers} worker(s); Ctrl+C to stop")
+    try:
+        # --once: one pass to see the files, one to queue them, then drain.
+        rounds = 0
+        while True:
+            watcher.poll()
+            rounds += 1
+            if args.once and rounds >= 2 and watcher.idle():
+                break
+            time.sleep(args.interval if not args.once else 0.1)
+    except KeyboardInterrupt:
+        log("Stopping; files not scored yet stay in the folder")
+    finally:
+        executor.shutdown(cancel_futures=True)
+        if output is not None:
+            output.close()
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
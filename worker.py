@@ -0,0 +1,147 @@
+import queue
+import threading
+
+import main  # process_sections(img) does the actual scoring
+import instrument
+from cache import ResultCache, file_fingerprint, image_key
+from layout import LayoutCache
+from loader import load_page, load_scan, page_name
+from profiles import fingerprint, get_profile
+
+
+class ScanCancelled(Exception):
+    """Raised inside a worker thread when the running scan was cancelled."""
+
+
+class ScanWorker:
+    """
+    Runs load_scan + main.process_sections on background threads so the
+    Tk main loop never blocks on image processing.
+
+    Scans are queued with submit() and processed in order; a page of a
+    multi-page TIFF/PDF is queued as its own scan. Everything the
+    worker wants to tell the UI goes through an event queue that the UI
+    drains with poll() (from a widget.after() callback). Each event is a
+    tuple whose first two items are the kind and the job id:
+
+      ("queued", job_id, name)   (the path, or loader.page_name for a page)
+      ("started", job_id, name)
+      ("progress", job_id, done, total, stage)
+      ("done", job_id, results)  (without images when served from the cache)
+      ("failed", job_id, message)
+      ("cancelled", job_id)
+    """
+
+    def __init__(self, workers=1, section_workers=None, profile=None):
+        self.workers = workers
+        # Passed on to process_sections(workers=...) to run the section
+        # detectors of a single scan in parallel.
+        self.section_workers = section_workers
+        # Detector settings of the scanner in use (see profiles.py).
+        self.profile = profile or get_profile()
+        # Grid layout learned from earlier scans, shared by all worker threads.
+        self.layout_cache = LayoutCache()
+        # Images scored before (same file bytes) are answered from disk.
+        self.result_cache = ResultCache()
+        self._jobs = queue.Queue()
+        self._events = queue.Queue()
+        self._cancelled = set()
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._threads = []
+
+    def start(self):
+        """Start the worker threads (daemon threads, so they never keep the app alive)."""
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._run, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Cancel everything still queued and let the threads exit."""
+        self.cancel_all()
+        for _ in self._threads:
+            self._jobs.put(None)
+        self._threads = []
+
+    def submit(self, path, page=None):
+        """Queue a scan (page: 0-based page of a TIFF/PDF) and return its job id."""
+        with self._lock:
+            job_id = self._next_id
+            self._next_id += 1
+        self._events.put(("queued", job_id, path if page is None else page_name(path, page)))
+        self._jobs.put((job_id, path, page))
+        return job_id
+
+    def cancel(self, job_id):
+        """Cancel a queued or running scan. A running scan stops at its next stage."""
+        with self._lock:
+            self._cancelled.add(job_id)
+
+    def cancel_all(self):
+        """Cancel every scan submitted so far."""
+        with self._lock:
+            self._cancelled.update(range(1, self._next_id))
+
+    def poll(self):
+        """Return (without blocking) every event posted since the last call."""
+        events = []
+        while True:
+            try:
+                events.append(self._events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def _is_cancelled(self, job_id):
+        with self._lock:
+            return job_id in self._cancelled
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            job_id, path, page = job
+            name = path if page is None else page_name(path, page)
+            if self._is_cancelled(job_id):
+                self._events.put(("cancelled", job_id))
+                continue
+
+            self._events.put(("started", job_id, name))
+
+            def progress(done, total, stage):
+                # Called by process_sections between sections; this is where
+                # a cancelled scan bails out.
+                if self._is_cancelled(job_id):
+                    raise ScanCancelled()
+                self._events.put(("progress", job_id, done, total, stage))
+
+            try:
+                with instrument.sheet(name):
+                    # Pages are decoded straight from their container and
+                    # not cached (that would mean hashing the whole stack).
+                    key = (image_key(path, profile=fingerprint(self.profile),
+                                     layout=file_fingerprint(self.layout_cache.path))
+                           if page is None else None)
+                    results = self.result_cache.get(key)[0] if key is not None else None
+                    if results is None:
+                        progress(0, 1, "Loading image")
+                        with instrument.timer("load_scan"):
+                            img = load_scan(path) if page is None else load_page(path, page)
+                        results = main.process_sections(img, progress=progress,
+                                                        workers=self.section_workers,
+                                                        layout_cache=self.layout_cache,
+                                                        profile=self.profile)
+                        # Sections read from a wrong grid fail the scan
+                        # instead of being stored with shifted scores.
+                        errors = main.section_errors(results)
+                        if errors:
+                            raise ValueError("; ".join(errors))
+                        if key is not None:
+                            self.result_cache.put(key, main.plain_results(results))
+            except ScanCancelled:
+                self._events.put(("cancelled", job_id))
+            except Exception as e:
+                self._events.put(("failed", job_id, str(e)))
+            else:
+                self._events.put(("done", job_id, results))